@@ -0,0 +1,154 @@
+import asyncio
+from bridgepy.exception import BizException
+import httpx
+from httpx import Response
+import logging
+from typing import Any
+
+from app.resilience import CircuitBreaker, backoff_delay
+
+
+logger = logging.getLogger(__name__)
+
+class AppSheetClient:
+    """
+    Pooled client for the AppSheet Action API of one app, shared by every table of the app.
+
+    Timeouts, 5xx and 429 responses count as AppSheet failures. Idempotent actions are retried on
+    them with jittered backoff, and enough failures in a row open a circuit breaker so calls fail fast
+    instead of piling up on a degraded AppSheet. A `Find` still running after `hedge_delay` seconds
+    is raced against a second identical one.
+    """
+
+    IDEMPOTENT_ACTIONS = {"Find", "Edit", "Delete"}
+
+    def __init__(
+        self,
+        app_id: str,
+        app_access_key: str,
+        base_url: str = "https://www.appsheet.com/api/v2",
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        max_rows_per_call: int = 100,
+        max_retries: int = 2,
+        retry_backoff: float = 0.2,
+        retry_max_backoff: float = 2.0,
+        circuit_breaker: CircuitBreaker | None = None,
+        hedge_delay: float | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.url = f"{base_url}/apps/{app_id}/tables"
+        self.headers = {"applicationAccessKey": app_access_key}
+        self.properties = {"Timezone": "Asia/Singapore"}
+        self.max_rows_per_call = max_rows_per_call
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker("appsheet")
+        self.hedge_delay = hedge_delay
+        self.client = httpx.AsyncClient(
+            headers = self.headers,
+            timeout = httpx.Timeout(timeout, connect = connect_timeout),
+            limits = httpx.Limits(
+                max_connections = max_connections,
+                max_keepalive_connections = max_keepalive_connections,
+                keepalive_expiry = keepalive_expiry,
+            ),
+            transport = transport,
+        )
+
+    @staticmethod
+    def text(value: str, code: int, description: str) -> str:
+        """
+        `value` as a text literal of a Selector expression. AppSheet expressions have no escape for a double
+        quote inside a text literal, so a value holding one is refused instead of being quoted as another value.
+        """
+        if '"' in value:
+            raise BizException(code, f"{description} failed, {value!r} has a double quote")
+        return f'"{value}"'
+
+    async def rows(self, table: str, action: str, rows: list[dict[str, Any]], code: int, description: str) -> list[dict[str, Any]]:
+        """
+        Runs `action` on `rows`, split into calls of up to `max_rows_per_call` rows, and returns the rows AppSheet answered with.
+        """
+        chunks = [rows[i : i + self.max_rows_per_call] for i in range(0, len(rows), self.max_rows_per_call)]
+        responses = await asyncio.gather(*[
+            self.post(table, {"Action": action, "Properties": self.properties, "Rows": chunk}, code, description) for chunk in chunks
+        ])
+        return [row for response in responses for row in self.__parse_list(response)]
+
+    async def find(self, table: str, selector: str, code: int, description: str) -> list[dict[str, Any]]:
+        response = await self.post(
+            table, {"Action": "Find", "Properties": {**self.properties, "Selector": selector}, "Rows": []}, code, description,
+        )
+        return self.__parse_list(response)
+
+    async def post(self, table: str, data: dict[str, Any], code: int, description: str) -> Response:
+        url = f"{self.url}/{table}/Action"
+        attempts = 1 + (self.max_retries if data["Action"] in self.IDEMPOTENT_ACTIONS else 0)
+        for attempt in range(attempts):
+            if not self.circuit_breaker.allow():
+                raise BizException(code, f"{description} failed fast, AppSheet circuit breaker is open")
+            try:
+                if data["Action"] == "Find" and self.hedge_delay is not None:
+                    response = await self.__send_hedged(url, data)
+                else:
+                    response = await self.client.post(url, json = data)
+            except httpx.HTTPError as e:
+                error, retryable = f"{description} failed with error: {e!r}", True
+            else:
+                if response.is_success:
+                    self.circuit_breaker.record_success()
+                    return response
+                error, retryable = f"{description} failed with response: {response}", self.__is_retryable(response)
+            if not retryable:
+                # AppSheet answered, the request itself is wrong
+                self.circuit_breaker.record_success()
+                raise BizException(code, error)
+            self.circuit_breaker.record_failure()
+            if attempt == attempts - 1:
+                raise BizException(code, error)
+            logger.warning(f"{error}, retrying")
+            await asyncio.sleep(backoff_delay(attempt, self.retry_backoff, self.retry_max_backoff))
+        raise BizException(code, f"{description} failed")
+
+    async def warm_up(self, table: str, connections: int = 1) -> None:
+        """
+        Opens up to `connections` pooled connections ahead of the first request, with concurrent Finds of a row id no row has.
+        """
+        await asyncio.gather(*[
+            self.rows(table, "Find", [{"id": ""}], 20004, f"warm up connection {i} to table: {table}") for i in range(connections)
+        ])
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def __send_hedged(self, url: str, data: dict[str, Any]) -> Response:
+        first = asyncio.create_task(self.client.post(url, json = data))
+        done, _ = await asyncio.wait({first}, timeout = self.hedge_delay)
+        if len(done) > 0:
+            return first.result()
+        pending = {first, asyncio.create_task(self.client.post(url, json = data))}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().is_success:
+                        return task.result()
+                if len(pending) == 0:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def __is_retryable(self, response: Response) -> bool:
+        return response.status_code >= 500 or response.status_code == 429
+
+    def __parse_list(self, response: Response) -> list[dict[str, Any]]:
+        body = response.json()
+        if type(body) is not list:
+            return []
+        return body
@@ -0,0 +1,202 @@
+import asyncio
+from bridgepy.bid import Bid
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+from bridgepy.player import PlayerBid, PlayerId
+from functools import cached_property, lru_cache
+import logging
+import time
+
+from app.appsheet import AppSheetClient
+from app.bridge import AsyncBridgeClient
+from app.codec import get_game_codec
+from app.config import Settings, get_settings
+from app.dataconverter import get_game_snapshot_response_assembler
+from app.datastore import (
+    AsyncDatastore, GameAppSheetDatastore, GameBatchingDatastore, GameCachedDatastore, GameEventSourcedDatastore,
+    GameInstrumentedDatastore, GameLocalDataStore, GameSingleFlightDatastore, GameSQLiteDatastore,
+)
+from app.event import GameEventAppSheetStore, GameEventSQLiteStore
+from app.game import VersionedGame
+from app.message import Message, MessageType
+from app.pubsub import LocalPubSub, PubSub, RedisPubSub
+from app.reaper import GameReaper
+from app.resilience import CircuitBreaker
+from app.websocket import GameWebSocketManager
+
+
+logger = logging.getLogger(__name__)
+
+class Backend:
+    """
+    The datastore stack, bridge client, pub/sub, WebSocket manager and reaper of the service, each built
+    on first use instead of at import, so importing `app.main` opens no connection and no file.
+
+    `start` runs once from the app lifespan: it starts the background tasks, then warms up the pooled
+    datastore connections and the models a first request would otherwise build. The backend is `ready`
+    once a warm up succeeded; until then `check_ready` tries again, at most one warm up at a time.
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.ready = False
+        self.warm_up_seconds: float | None = None
+        self.warm_up_lock = asyncio.Lock()
+
+    @cached_property
+    def appsheet(self) -> AppSheetClient | None:
+        if not self.settings.use_app_sheet:
+            return None
+        return AppSheetClient(
+            self.settings.app_sheet_app_id,
+            self.settings.app_sheet_app_access_key,
+            base_url = self.settings.app_sheet_base_url,
+            timeout = self.settings.app_sheet_timeout,
+            connect_timeout = self.settings.app_sheet_connect_timeout,
+            max_connections = self.settings.app_sheet_max_connections,
+            max_keepalive_connections = self.settings.app_sheet_max_keepalive_connections,
+            keepalive_expiry = self.settings.app_sheet_keepalive_expiry,
+            max_rows_per_call = self.settings.app_sheet_max_rows_per_call,
+            max_retries = self.settings.app_sheet_max_retries,
+            retry_backoff = self.settings.app_sheet_retry_backoff,
+            retry_max_backoff = self.settings.app_sheet_retry_max_backoff,
+            circuit_breaker = CircuitBreaker(
+                "appsheet",
+                failure_threshold = self.settings.app_sheet_circuit_failure_threshold,
+                reset_timeout = self.settings.app_sheet_circuit_reset_timeout,
+            ),
+            hedge_delay = self.settings.app_sheet_hedge_delay,
+        )
+
+    @cached_property
+    def base_datastore(self) -> AsyncDatastore[GameId, VersionedGame]:
+        if self.appsheet is not None:
+            return GameAppSheetDatastore(
+                self.appsheet,
+                self.settings.app_sheet_game_table,
+                codec = get_game_codec(self.settings.app_sheet_game_codec),
+                # with the event log on, the log checks versions and the game row is only a snapshot
+                check_version = self.settings.app_sheet_check_version and not self.settings.use_event_log,
+                warm_up_connections = self.settings.app_sheet_warm_up_connections,
+            )
+        if self.settings.sqlite_path:
+            return GameSQLiteDatastore(self.settings.sqlite_path)
+        return GameLocalDataStore()
+
+    @cached_property
+    def game_datastore(self) -> AsyncDatastore[GameId, VersionedGame]:
+        settings = self.settings
+        game_datastore = self.base_datastore
+        if settings.use_metrics:
+            game_datastore = GameInstrumentedDatastore(
+                game_datastore, "appsheet" if settings.use_app_sheet else "sqlite" if settings.sqlite_path else "local",
+            )
+        if settings.use_event_log and (self.appsheet is not None or settings.sqlite_path):
+            game_datastore = GameEventSourcedDatastore(
+                game_datastore,
+                GameEventAppSheetStore(self.appsheet, settings.app_sheet_event_table, check_version = settings.app_sheet_check_version)
+                if self.appsheet is not None else GameEventSQLiteStore(settings.sqlite_path),
+                codec = get_game_codec(settings.app_sheet_game_codec) if self.appsheet is not None else None,
+                snapshot_interval = settings.game_snapshot_interval,
+            )
+            if settings.use_metrics:
+                game_datastore = GameInstrumentedDatastore(game_datastore, "eventlog")
+        if settings.use_app_sheet and settings.use_single_flight:
+            game_datastore = GameSingleFlightDatastore(game_datastore)
+        if settings.use_app_sheet and settings.app_sheet_write_batch_window > 0:
+            game_datastore = GameBatchingDatastore(game_datastore, window = settings.app_sheet_write_batch_window)
+        if settings.use_app_sheet and settings.use_game_cache:
+            game_datastore = GameCachedDatastore(
+                game_datastore,
+                max_size = settings.game_cache_max_size,
+                ttl = settings.game_cache_ttl,
+                flush_interval = settings.game_cache_flush_interval,
+                # looked up on use, the socket manager is built on top of this datastore
+                on_conflict = lambda game: self.game_socket_manager.resync_game(game),
+            )
+            if settings.use_metrics:
+                game_datastore = GameInstrumentedDatastore(game_datastore, "cache")
+        return game_datastore
+
+    @cached_property
+    def bridge_client(self) -> AsyncBridgeClient:
+        return AsyncBridgeClient(
+            self.game_datastore,
+            bulk_chunk_size = self.settings.app_sheet_max_rows_per_call,
+            bulk_concurrency = self.settings.game_batch_concurrency,
+        )
+
+    @cached_property
+    def pubsub(self) -> PubSub:
+        return RedisPubSub(self.settings.redis_url) if self.settings.redis_url else LocalPubSub()
+
+    @cached_property
+    def game_socket_manager(self) -> GameWebSocketManager:
+        return GameWebSocketManager(
+            pubsub = self.pubsub,
+            game_watcher = self.bridge_client.game_watcher,
+            send_queue_size = self.settings.websocket_send_queue_size,
+            send_timeout = self.settings.websocket_send_timeout,
+            spectator_delay = self.settings.spectator_delay_seconds,
+        )
+
+    @cached_property
+    def game_reaper(self) -> GameReaper:
+        return GameReaper(
+            self.bridge_client,
+            self.game_socket_manager,
+            finished_ttl = self.settings.game_finished_ttl,
+            idle_ttl = self.settings.game_idle_ttl,
+            interval = self.settings.game_reaper_interval,
+            page_size = self.settings.app_sheet_max_rows_per_call,
+            index = self.base_datastore if isinstance(self.base_datastore, GameSQLiteDatastore) else None,
+        )
+
+    async def start(self) -> None:
+        # the manager subscribes its channels on creation, so it has to exist before pub/sub starts
+        self.game_socket_manager
+        await self.game_datastore.start()
+        await self.pubsub.start()
+        await self.game_reaper.start()
+        await self.warm_up()
+
+    async def close(self) -> None:
+        self.ready = False
+        await self.game_reaper.close()
+        await self.pubsub.close()
+        await self.game_datastore.close()
+
+    async def check_ready(self) -> bool:
+        if not self.ready and not self.warm_up_lock.locked():
+            await self.warm_up()
+        return self.ready
+
+    async def warm_up(self) -> None:
+        async with self.warm_up_lock:
+            if self.ready:
+                return
+            start = time.perf_counter()
+            try:
+                await self.game_datastore.warm_up()
+            except BizException as e:
+                logger.warning(f"backend warm up failed: {e.msg}")
+                return
+            self.__warm_up_models()
+            self.warm_up_seconds = time.perf_counter() - start
+            self.ready = True
+            logger.info(f"backend warmed up in {self.warm_up_seconds:.3f}s")
+
+    def __warm_up_models(self) -> None:
+        # runs a dealt game through the codec, the snapshot assembler and a message once, building the
+        # deferred pydantic schemas and codec lookups on the path of every move
+        game = VersionedGame(id = GameId("warm-up"), player_ids = [PlayerId(f"warm-up-{i}") for i in range(4)])
+        game.deal()
+        game.bid(PlayerBid(player_id = game.next_bid_player_id(), bid = Bid.from_string("1NT")))
+        codec = get_game_codec(self.settings.app_sheet_game_codec)
+        codec.decode(codec.encode(game))
+        snapshot = get_game_snapshot_response_assembler().convert(game.player_snapshot(game.player_ids[0]))
+        Message.model_validate_json(Message(message_type = MessageType.GAME, snapshot = snapshot, version = game.version).model_dump_json(by_alias = True))
+
+@lru_cache
+def get_backend() -> Backend:
+    return Backend(get_settings())
@@ -0,0 +1,191 @@
+import asyncio
+from bridgepy.bid import Bid
+from bridgepy.card import Card
+from bridgepy.exception import BizException, BridgeGameAlreadyCreatedException, BridgeGameNotFoundException
+from bridgepy.game import GameId, GamePlayerSnapshot
+from bridgepy.player import PlayerBid, PlayerId, PlayerTrick
+from contextlib import AsyncExitStack, asynccontextmanager
+import copy
+from typing import Awaitable, Callable, TypeVar
+from uuid import uuid4
+
+from app.datastore import AsyncDatastore
+from app.exception import GameActionFailedException, GameVersionConflictException
+from app.game import GameStatus, VersionedGame
+from app.watcher import GameVersionWatcher
+
+
+T = TypeVar("T")
+
+
+class AsyncBridgeClient:
+
+    def __init__(
+        self,
+        game_datastore: AsyncDatastore[GameId, VersionedGame],
+        max_retries: int = 3,
+        bulk_chunk_size: int = 100,
+        bulk_concurrency: int = 4,
+    ) -> None:
+        self.game_datastore = game_datastore
+        self.game_watcher = GameVersionWatcher()
+        self.max_retries = max_retries
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_semaphore = asyncio.Semaphore(bulk_concurrency)
+        self.game_locks: dict[str, asyncio.Lock] = {}
+        self.game_lock_holders: dict[str, int] = {}
+
+    async def create_game(self, player_id: PlayerId, game_id: GameId) -> VersionedGame:
+        async with self.__game_lock(game_id):
+            game = await self.game_datastore.query(game_id)
+            if game is not None:
+                raise BridgeGameAlreadyCreatedException()
+            game = VersionedGame(id = game_id, player_ids = [player_id], instance = uuid4().hex)
+            await self.game_datastore.insert(game)
+        self.game_watcher.notify(game_id.value)
+        return game
+
+    async def delete_game(self, game_id: GameId) -> None:
+        async with self.__game_lock(game_id):
+            await self.game_datastore.delete(game_id)
+        self.game_watcher.notify(game_id.value)
+
+    async def join_game(self, player_id: PlayerId, game_id: GameId) -> VersionedGame:
+        return await self.__update_game(game_id, lambda game: game.add_player(player_id))
+
+    async def view_game(self, player_id: PlayerId, game_id: GameId) -> GamePlayerSnapshot:
+        game = await self.find_game(game_id)
+        return game.player_snapshot(player_id)
+
+    async def bid(self, player_id: PlayerId, game_id: GameId, bid: Bid | None) -> VersionedGame:
+        return await self.__update_game(game_id, lambda game: game.bid(PlayerBid(player_id = player_id, bid = bid)))
+
+    async def choose_partner(self, player_id: PlayerId, game_id: GameId, partner: Card) -> VersionedGame:
+        return await self.__update_game(game_id, lambda game: game.choose_partner(player_id, partner))
+
+    async def trick(self, player_id: PlayerId, game_id: GameId, trick: Card) -> VersionedGame:
+        return await self.__update_game(game_id, lambda game: game.trick(PlayerTrick(player_id = player_id, trick = trick)))
+
+    async def reset_game(self, player_id: PlayerId, game_id: GameId) -> VersionedGame:
+        return await self.__update_game(game_id, lambda game: game.reset(player_id))
+
+    async def apply_actions(self, game_id: GameId, actions: list[Callable[[VersionedGame], None]]) -> VersionedGame:
+        """
+        Applies `actions` in order to one load of the game and saves it once, bumping the version per action.
+        All or nothing: they run on a copy, and the first failing one raises `GameActionFailedException`
+        with its index while the saved game stays as it was.
+        """
+        async with self.__game_lock(game_id):
+            attempt = 0
+            while True:
+                # the datastore may hand out the object it keeps, so a failed batch must not touch it
+                game = copy.deepcopy(await self.find_game(game_id))
+                for index, action in enumerate(actions):
+                    try:
+                        action(game)
+                    except BizException as e:
+                        raise GameActionFailedException(index, e)
+                    game.version += 1
+                try:
+                    await self.game_datastore.update(game)
+                    break
+                except GameVersionConflictException:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+        self.game_watcher.notify(game_id.value)
+        return game
+
+    async def find_game(self, game_id: GameId) -> VersionedGame:
+        game = await self.game_datastore.query(game_id)
+        if game is None:
+            raise BridgeGameNotFoundException()
+        return game
+
+    async def find_games(self, game_ids: list[GameId]) -> list[VersionedGame | None]:
+        chunks = await self.__bulk(self.game_datastore.query_many, game_ids)
+        return [game for chunk in chunks for game in chunk]
+
+    async def delete_games(self, game_ids: list[GameId], versions: dict[str, int] | None = None) -> list[GameId]:
+        """
+        Deletes the games in bulk and returns the ids deleted. With `versions`, a game is only deleted while
+        it is still at its version there, checked under the game's lock, so one moved since is kept.
+        """
+        game_ids = list({game_id.value: game_id for game_id in game_ids}.values())
+        async with AsyncExitStack() as stack:
+            # locks are taken in id order so concurrent batches cannot deadlock each other
+            for game_id in sorted(game_ids, key = lambda game_id: game_id.value):
+                await stack.enter_async_context(self.__game_lock(game_id))
+            if versions is not None:
+                games = await self.find_games(game_ids)
+                game_ids = [
+                    game_id for game_id, game in zip(game_ids, games) if game is not None and game.version == versions.get(game_id.value)
+                ]
+            await self.__bulk(self.game_datastore.delete_many, game_ids)
+        for game_id in game_ids:
+            self.game_watcher.notify(game_id.value)
+        return game_ids
+
+    async def list_games(
+        self, after: GameId | None, limit: int, statuses: set[GameStatus],
+    ) -> tuple[list[VersionedGame], GameId | None]:
+        """
+        One page of games in id order, keeping only the given statuses, along with the cursor for
+        the next page. A filtered page can hold fewer than `limit` games even when more follow.
+        """
+        games = await self.game_datastore.query_page(after, limit)
+        next_after = games[-1].id if len(games) == limit else None
+        return [game for game in games if game.status() in statuses], next_after
+
+    async def wait_game(self, game_id: GameId, since_version: int, timeout: float, since_instance: str | None = None) -> VersionedGame:
+        """
+        The game once its version is no longer `since_version` (of the game instance `since_instance`, when given), or as it is
+        after `timeout` seconds.
+        """
+        deadline = asyncio.get_event_loop().time() + timeout
+        while True:
+            changed = self.game_watcher.watch(game_id.value)
+            game = await self.find_game(game_id)
+            if game.version != since_version or since_instance not in (None, game.instance):
+                return game
+            remaining = deadline - asyncio.get_event_loop().time()
+            if remaining <= 0 or not await self.game_watcher.wait(changed, remaining):
+                return game
+
+    async def __update_game(self, game_id: GameId, action: Callable[[VersionedGame], None]) -> VersionedGame:
+        async with self.__game_lock(game_id):
+            attempt = 0
+            while True:
+                game = await self.find_game(game_id)
+                action(game)
+                game.version += 1
+                try:
+                    await self.game_datastore.update(game)
+                    break
+                except GameVersionConflictException:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+        self.game_watcher.notify(game_id.value)
+        return game
+
+    async def __bulk(self, operation: Callable[[list[GameId]], Awaitable[T]], game_ids: list[GameId]) -> list[T]:
+        async def run(chunk: list[GameId]) -> T:
+            async with self.bulk_semaphore:
+                return await operation(chunk)
+        return list(await asyncio.gather(*[
+            run(game_ids[i : i + self.bulk_chunk_size]) for i in range(0, len(game_ids), self.bulk_chunk_size)
+        ]))
+
+    @asynccontextmanager
+    async def __game_lock(self, game_id: GameId):
+        lock = self.game_locks.setdefault(game_id.value, asyncio.Lock())
+        self.game_lock_holders[game_id.value] = self.game_lock_holders.get(game_id.value, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.game_lock_holders[game_id.value] -= 1
+            if self.game_lock_holders[game_id.value] == 0:
+                del self.game_lock_holders[game_id.value]
+                del self.game_locks[game_id.value]
@@ -0,0 +1,189 @@
+from abc import ABC, abstractmethod
+from bridgepy.bid import Bid
+from bridgepy.card import Card, Rank, Suit
+from bridgepy.game import GameId, GameTrick
+from bridgepy.player import PlayerBid, PlayerHand, PlayerId, PlayerTrick
+from dataclasses import asdict
+from functools import lru_cache
+from typing import Any
+import jsons
+import orjson
+
+from app.game import VersionedGame
+
+
+CARDS: dict[str, Card] = {card.__repr__(): card for card in (Card(rank = rank, suit = suit) for rank in Rank for suit in Suit)}
+BIDS: dict[str, Bid] = {bid.__repr__(): bid for bid in (Bid(level = level, suit = suit) for level in range(1, 8) for suit in [*Suit, None])}
+COMPACT_VERSION = 2
+
+class GameCodec(ABC):
+
+    @abstractmethod
+    def encode(self, game: VersionedGame) -> str:
+        pass
+
+    @abstractmethod
+    def decode(self, data: str) -> VersionedGame:
+        pass
+
+class JsonsGameCodec(GameCodec):
+    """
+    Reflection based codec the game rows were originally written with.
+    """
+
+    def encode(self, game: VersionedGame) -> str:
+        return jsons.dumps(asdict(game))
+
+    def decode(self, data: str) -> VersionedGame:
+        return jsons.load(jsons.loads(data), VersionedGame)
+
+class OrjsonGameCodec(GameCodec):
+    """
+    Hand written field mapping on top of orjson.
+
+    Encodes the same document shape as `JsonsGameCodec`, or the compact shape (cards and bids as
+    their string form, ids unwrapped) when `compact` is set. Decoding accepts both shapes so rows
+    written by either codec stay readable.
+    """
+
+    def __init__(self, compact: bool = True) -> None:
+        self.compact = compact
+
+    def encode(self, game: VersionedGame) -> str:
+        if self.compact:
+            return orjson.dumps(self.__to_compact(game)).decode()
+        return orjson.dumps(self.__to_verbose(game)).decode()
+
+    def decode(self, data: str) -> VersionedGame:
+        doc: dict[str, Any] = orjson.loads(data)
+        if doc.get("v") == COMPACT_VERSION:
+            return self.__from_compact(doc)
+        return self.__from_verbose(doc)
+
+    def __to_compact(self, game: VersionedGame) -> dict[str, Any]:
+        return {
+            "v": COMPACT_VERSION,
+            "id": game.id.value,
+            "players": [player_id.value for player_id in game.player_ids],
+            "hands": [
+                [player_hand.player_id.value, [card.__repr__() for card in player_hand.cards]] for player_hand in game.player_hands
+            ],
+            "bids": [
+                [player_bid.player_id.value, None if player_bid.bid is None else player_bid.bid.__repr__()] for player_bid in game.bids
+            ],
+            "partner": None if game.partner is None else game.partner.__repr__(),
+            "partnerPlayer": None if game.partner_player_id is None else game.partner_player_id.value,
+            "tricks": [
+                [[player_trick.player_id.value, player_trick.trick.__repr__()] for player_trick in game_trick.player_tricks]
+                    for game_trick in game.tricks
+            ],
+            "resetVotes": [player_id.value for player_id in game.reset_votes],
+            "version": game.version,
+            "instance": game.instance,
+        }
+
+    def __from_compact(self, doc: dict[str, Any]) -> VersionedGame:
+        return VersionedGame(
+            id = GameId(doc["id"]),
+            player_ids = [PlayerId(player_id) for player_id in doc["players"]],
+            player_hands = [
+                PlayerHand(player_id = PlayerId(player_id), cards = [CARDS[card] for card in cards]) for player_id, cards in doc["hands"]
+            ],
+            bids = [
+                PlayerBid(player_id = PlayerId(player_id), bid = None if bid is None else BIDS[bid]) for player_id, bid in doc["bids"]
+            ],
+            partner = None if doc["partner"] is None else CARDS[doc["partner"]],
+            partner_player_id = None if doc["partnerPlayer"] is None else PlayerId(doc["partnerPlayer"]),
+            tricks = [
+                GameTrick(player_tricks = [
+                    PlayerTrick(player_id = PlayerId(player_id), trick = CARDS[card]) for player_id, card in player_tricks
+                ]) for player_tricks in doc["tricks"]
+            ],
+            reset_votes = [PlayerId(player_id) for player_id in doc["resetVotes"]],
+            version = doc["version"],
+            instance = doc.get("instance", ""),
+        )
+
+    def __to_verbose(self, game: VersionedGame) -> dict[str, Any]:
+        return {
+            "id": {"value": game.id.value},
+            "player_ids": [{"value": player_id.value} for player_id in game.player_ids],
+            "player_hands": [
+                {
+                    "player_id": {"value": player_hand.player_id.value},
+                    "cards": [self.__card_to_verbose(card) for card in player_hand.cards],
+                } for player_hand in game.player_hands
+            ],
+            "bids": [
+                {
+                    "player_id": {"value": player_bid.player_id.value},
+                    "bid": None if player_bid.bid is None else {
+                        "level": player_bid.bid.level,
+                        "suit": None if player_bid.bid.suit is None else player_bid.bid.suit.name,
+                    },
+                } for player_bid in game.bids
+            ],
+            "partner": None if game.partner is None else self.__card_to_verbose(game.partner),
+            "partner_player_id": None if game.partner_player_id is None else {"value": game.partner_player_id.value},
+            "tricks": [
+                {
+                    "player_tricks": [
+                        {
+                            "player_id": {"value": player_trick.player_id.value},
+                            "trick": self.__card_to_verbose(player_trick.trick),
+                        } for player_trick in game_trick.player_tricks
+                    ]
+                } for game_trick in game.tricks
+            ],
+            "reset_votes": [{"value": player_id.value} for player_id in game.reset_votes],
+            "version": game.version,
+            "instance": game.instance,
+        }
+
+    def __from_verbose(self, doc: dict[str, Any]) -> VersionedGame:
+        return VersionedGame(
+            id = GameId(doc["id"]["value"]),
+            player_ids = [PlayerId(player_id["value"]) for player_id in doc["player_ids"]],
+            player_hands = [
+                PlayerHand(
+                    player_id = PlayerId(player_hand["player_id"]["value"]),
+                    cards = [self.__card_from_verbose(card) for card in player_hand["cards"]],
+                ) for player_hand in doc.get("player_hands", [])
+            ],
+            bids = [
+                PlayerBid(
+                    player_id = PlayerId(player_bid["player_id"]["value"]),
+                    bid = None if player_bid["bid"] is None else Bid(
+                        level = player_bid["bid"]["level"],
+                        suit = None if player_bid["bid"]["suit"] is None else Suit[player_bid["bid"]["suit"]],
+                    ),
+                ) for player_bid in doc.get("bids", [])
+            ],
+            partner = None if doc.get("partner") is None else self.__card_from_verbose(doc["partner"]),
+            partner_player_id = None if doc.get("partner_player_id") is None else PlayerId(doc["partner_player_id"]["value"]),
+            tricks = [
+                GameTrick(player_tricks = [
+                    PlayerTrick(
+                        player_id = PlayerId(player_trick["player_id"]["value"]),
+                        trick = self.__card_from_verbose(player_trick["trick"]),
+                    ) for player_trick in game_trick["player_tricks"]
+                ]) for game_trick in doc.get("tricks", [])
+            ],
+            reset_votes = [PlayerId(player_id["value"]) for player_id in doc.get("reset_votes", [])],
+            version = doc.get("version", 0),
+            instance = doc.get("instance", ""),
+        )
+
+    def __card_to_verbose(self, card: Card) -> dict[str, str]:
+        return {"rank": card.rank.name, "suit": card.suit.name}
+
+    def __card_from_verbose(self, card: dict[str, str]) -> Card:
+        return Card(rank = Rank[card["rank"]], suit = Suit[card["suit"]])
+
+@lru_cache
+def get_game_codec(name: str) -> GameCodec:
+    if name == "jsons":
+        return JsonsGameCodec()
+    if name == "json":
+        return OrjsonGameCodec(compact = False)
+    return OrjsonGameCodec(compact = True)
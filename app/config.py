@@ -6,9 +6,45 @@ class Settings(BaseSettings):
     app_sheet_app_id: str
     app_sheet_game_table: str
     app_sheet_app_access_key: str
+    app_sheet_base_url: str = "https://www.appsheet.com/api/v2"
+    app_sheet_timeout: float = 10.0
+    app_sheet_connect_timeout: float = 5.0
+    app_sheet_max_connections: int = 100
+    app_sheet_max_keepalive_connections: int = 20
+    app_sheet_keepalive_expiry: float = 30.0
+    app_sheet_warm_up_connections: int = 4
+    app_sheet_game_codec: str = "compact"
+    app_sheet_check_version: bool = True
+    app_sheet_max_rows_per_call: int = 100
+    app_sheet_write_batch_window: float = 0.0
+    app_sheet_max_retries: int = 2
+    app_sheet_retry_backoff: float = 0.2
+    app_sheet_retry_max_backoff: float = 2.0
+    app_sheet_circuit_failure_threshold: int = 5
+    app_sheet_circuit_reset_timeout: float = 30.0
+    app_sheet_hedge_delay: float | None = None
+    app_sheet_event_table: str = "game_event"
     use_app_sheet: bool = True
+    sqlite_path: str | None = None
+    use_event_log: bool = False
+    game_snapshot_interval: int = 16
+    use_single_flight: bool = True
+    use_game_cache: bool = True
+    game_cache_max_size: int = 1000
+    game_cache_ttl: float = 3600.0
+    game_cache_flush_interval: float = 1.0
     cors_allow_origin: str = "*"
+    view_max_wait_seconds: float = 30.0
+    game_batch_concurrency: int = 4
+    game_finished_ttl: float | None = None
+    game_idle_ttl: float | None = None
+    game_reaper_interval: float = 300.0
     websocket_ping_interval: int = 20
+    redis_url: str | None = None
+    websocket_send_queue_size: int = 32
+    websocket_send_timeout: float = 5.0
+    spectator_delay_seconds: float = 0.0
+    use_metrics: bool = True
 
     model_config = SettingsConfigDict(env_file = ".env")
 
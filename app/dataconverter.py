@@ -1,15 +1,26 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Generic, TypeVar
+from typing import Any, Generic, TypeVar
 from bridgepy.bid import Bid
+from bridgepy.card import Card
+from bridgepy.exception import GamePlayerNotFound
 from bridgepy.game import GamePlayerSnapshot
+from bridgepy.player import PlayerAction, PlayerId
+import orjson
 
+from app.game import GameStatus, VersionedGame
 from app.model import BidEnum, CardEnum, GameTrick, PlayerBid, PlayerScore, PlayerTrick
 from app.response import GamePlayerSnapshotResponse
 
 T = TypeVar("T")
 R = TypeVar("R")
 
+CARD_ENUMS: dict[Card, CardEnum] = {Card.from_string(card_enum.value): card_enum for card_enum in CardEnum}
+BID_ENUMS: dict[tuple, BidEnum] = {
+    (bid.level, bid.suit): bid_enum for bid_enum in BidEnum if bid_enum != BidEnum.PASS for bid in [Bid.from_string(bid_enum.value)]
+}
+
 class DataConverter(ABC, Generic[T, R]):
 
     @abstractmethod
@@ -19,35 +30,38 @@ class DataConverter(ABC, Generic[T, R]):
 class GameSnapshotResponseAssembler(DataConverter[GamePlayerSnapshot, GamePlayerSnapshotResponse]):
 
     def convert(self, data: GamePlayerSnapshot) -> GamePlayerSnapshotResponse:
+        trump_suit = None if data.bid_winner is None else data.bid_winner.require_bid().suit
+        trick_winners = [
+            game_trick.trick_winner(trump_suit) if game_trick.ready_for_trick_winner() else None
+                for game_trick in data.tricks
+        ]
         return GamePlayerSnapshotResponse(
             game_id = data.game_id.value,
             player_id = data.player_id.value,
             player_actions = data.player_actions,
-            player_hand = [
-                CardEnum(card.__repr__()) for card in data.player_hand.cards
-            ],
+            player_hand = [CARD_ENUMS[card] for card in data.player_hand.cards],
             bids = [
                 PlayerBid(
                     player_id = player_bid.player_id.value,
-                    bid = None if player_bid.bid is None else BidEnum(player_bid.bid.__repr__())
+                    bid = None if player_bid.bid is None else BID_ENUMS[(player_bid.bid.level, player_bid.bid.suit)]
                 ) for player_bid in data.bids
             ],
             bid_winner = None if data.bid_winner is None else data.bid_winner.player_id.value,
             bid_level = None if data.bid_winner is None else data.bid_winner.require_bid().level,
-            trump_suit = None if data.bid_winner is None else data.bid_winner.require_bid().suit,
-            partner = None if data.partner is None else CardEnum(data.partner.__repr__()),
+            trump_suit = trump_suit,
+            partner = None if data.partner is None else CARD_ENUMS[data.partner],
             partner_player_id = None if data.partner_player_id is None else data.partner_player_id.value,
             tricks = [
                 GameTrick(
                     player_tricks = [
                         PlayerTrick(
                             player_id = player_trick.player_id.value,
-                            trick = CardEnum(player_trick.trick.__repr__()),
-                            won = game_trick.trick_winner(data.require_bid_winner().require_bid().suit) == player_trick.player_id
-                                if game_trick.ready_for_trick_winner() else False,
+                            trick = CARD_ENUMS[player_trick.trick],
+                            won = trick_winner == player_trick.player_id,
                         ) for player_trick in game_trick.player_tricks
                     ]
-                ) for game_trick in data.tricks],
+                ) for game_trick, trick_winner in zip(data.tricks, trick_winners)
+            ],
             scores = [
                 PlayerScore(
                     player_id = player_score.player_id.value,
@@ -64,6 +78,133 @@ class BidRequestBuilder(DataConverter[BidEnum, Bid | None]):
     def convert(self, data: BidEnum) -> Bid | None:
         return None if data == BidEnum.PASS else Bid.from_string(data.value)
 
+class GameSnapshotPatchBuilder(DataConverter[tuple[dict[str, Any], dict[str, Any]], list[dict[str, Any]]]):
+    """
+    Diffs two serialized player snapshots into patch operations:
+    `set` replaces a field, `splice` keeps the first `at` items of a list field and appends `items`.
+    """
+
+    def convert(self, data: tuple[dict[str, Any], dict[str, Any]]) -> list[dict[str, Any]]:
+        old, new = data
+        patch: list[dict[str, Any]] = []
+        for path, value in new.items():
+            old_value = old.get(path)
+            if old_value == value:
+                continue
+            if type(value) is not list or type(old_value) is not list:
+                patch.append({"op": "set", "path": path, "value": value})
+                continue
+            at = 0
+            while at < len(old_value) and at < len(value) and old_value[at] == value[at]:
+                at += 1
+            patch.append({"op": "splice", "path": path, "at": at, "items": value[at:]})
+        return patch
+
+class GameSnapshotSerializer:
+    """
+    Memoizes the serialized player snapshot per (game, instance, version, player) so repeated views
+    and broadcasts of an unchanged game reuse the same JSON.
+
+    Only the player id, actions and hand differ between seats, so the rest of the snapshot (bids,
+    tricks, scores, turn) is assembled once per (game, instance, version) and shared by every seat.
+    """
+
+    SEAT_PATHS = {"playerId", "playerActions", "playerHand"}
+
+    def __init__(self, assembler: DataConverter[GamePlayerSnapshot, GamePlayerSnapshotResponse], max_size: int = 4096) -> None:
+        self.assembler = assembler
+        self.max_size = max_size
+        self.snapshots: OrderedDict[tuple[str, str, int, str], tuple[str, dict[str, Any]]] = OrderedDict()
+        self.public_snapshots: OrderedDict[tuple[str, str, int], dict[str, Any]] = OrderedDict()
+        self.spectator_snapshots: OrderedDict[tuple[str, str, int], str] = OrderedDict()
+
+    def serialize(self, game: VersionedGame, player_id: PlayerId) -> str:
+        return self.__snapshot(game, player_id)[0]
+
+    def to_dict(self, game: VersionedGame, player_id: PlayerId) -> dict[str, Any]:
+        return self.__snapshot(game, player_id)[1]
+
+    def __snapshot(self, game: VersionedGame, player_id: PlayerId) -> tuple[str, dict[str, Any]]:
+        key = (game.id.value, game.instance, game.version, player_id.value)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None:
+            self.snapshots.move_to_end(key)
+            return snapshot
+        if player_id not in game.player_ids:
+            raise GamePlayerNotFound()
+        public = self.__public_snapshot(game)
+        # same keys in the same order as the assembled response, only the seat's own fields replaced
+        data = {
+            **public,
+            "playerId": player_id.value,
+            "playerActions": self.__player_actions(game, public, player_id),
+            "playerHand": [CARD_ENUMS[card].value for card in game.find_player_hand(player_id).cards],
+        }
+        snapshot = (orjson.dumps(data).decode(), data)
+        self.__remember(self.snapshots, key, snapshot)
+        return snapshot
+
+    def __public_snapshot(self, game: VersionedGame) -> dict[str, Any]:
+        key = (game.id.value, game.instance, game.version)
+        public = self.public_snapshots.get(key)
+        if public is not None:
+            self.public_snapshots.move_to_end(key)
+            return public
+        response = self.assembler.convert(game.player_snapshot(game.player_ids[0]))
+        response.version = game.version
+        public = response.model_dump(mode = "json", by_alias = True)
+        self.__remember(self.public_snapshots, key, public)
+        return public
+
+    def __player_actions(self, game: VersionedGame, public: dict[str, Any], player_id: PlayerId) -> list[str]:
+        # as bridgepy's player_snapshot: the action of the turn, then RESET once the game is concluded
+        player_actions: list[str] = []
+        if public["playerTurn"] == player_id.value:
+            status = game.status()
+            if status == GameStatus.BIDDING:
+                player_actions.append(PlayerAction.BID.value)
+            elif status == GameStatus.CHOOSING_PARTNER:
+                player_actions.append(PlayerAction.CHOOSE_PARTNER.value)
+            elif status == GameStatus.PLAYING:
+                player_actions.append(PlayerAction.TRICK.value)
+        scores = public["scores"]
+        if any(score["won"] for score in scores) and not any(score["playerId"] == player_id.value and score["voted"] for score in scores):
+            player_actions.append(PlayerAction.RESET.value)
+        return player_actions
+
+    def serialize_spectator(self, game: VersionedGame) -> str:
+        """
+        The snapshot a spectator sees: everything public, no hands and no seat.
+        """
+        key = (game.id.value, game.instance, game.version)
+        snapshot = self.spectator_snapshots.get(key)
+        if snapshot is not None:
+            self.spectator_snapshots.move_to_end(key)
+            return snapshot
+        public = self.__public_snapshot(game)
+        data = {
+            "gameId": public["gameId"],
+            "playerIds": [player_id.value for player_id in game.player_ids],
+            "status": game.status().value,
+            **{path: value for path, value in public.items() if path not in self.SEAT_PATHS},
+        }
+        snapshot = orjson.dumps(data).decode()
+        self.__remember(self.spectator_snapshots, key, snapshot)
+        return snapshot
+
+    def forget(self, game_id: str) -> None:
+        """
+        Drops every memoized snapshot of the game, for when its stored version turns out to differ from the one memoized.
+        """
+        for memo in (self.snapshots, self.public_snapshots, self.spectator_snapshots):
+            for key in [key for key in memo if key[0] == game_id]:
+                del memo[key]
+
+    def __remember(self, memo: OrderedDict, key: tuple, value: Any) -> None:
+        memo[key] = value
+        if len(memo) > self.max_size:
+            memo.popitem(last = False)
+
 @lru_cache
 def get_game_snapshot_response_assembler() -> DataConverter[GamePlayerSnapshot, GamePlayerSnapshotResponse]:
     return GameSnapshotResponseAssembler()
@@ -71,3 +212,11 @@ def get_game_snapshot_response_assembler() -> DataConverter[GamePlayerSnapshot,
 @lru_cache
 def get_bid_request_builder() -> DataConverter[BidEnum, Bid | None]:
     return BidRequestBuilder()
+
+@lru_cache
+def get_game_snapshot_patch_builder() -> DataConverter[tuple[dict[str, Any], dict[str, Any]], list[dict[str, Any]]]:
+    return GameSnapshotPatchBuilder()
+
+@lru_cache
+def get_game_snapshot_serializer() -> GameSnapshotSerializer:
+    return GameSnapshotSerializer(get_game_snapshot_response_assembler())
@@ -1,96 +1,930 @@
-from bridgepy.datastore import Datastore
+from abc import ABC, abstractmethod
+import asyncio
+from bridgepy.entity import Entity
 from bridgepy.exception import BizException
-from bridgepy.game import GameId, Game
-from dataclasses import asdict
-import jsons
-import requests
-from requests import Response
-
-
-class GameAppSheetDatastore(Datastore[GameId, Game]):
-
-    def __init__(self, app_id: str, table: str, app_access_key: str) -> None:
-        self.url = f"https://www.appsheet.com/api/v2/apps/{app_id}/tables/{table}/Action"
-        self.headers = {"applicationAccessKey": app_access_key}
-        self.properties = {"Timezone": "Asia/Singapore"}
-
-    def insert(self, entity: Game) -> None:
-        data = {
-            "Action": "Add",
-            "Properties": self.properties,
-            "Rows": [
-                {
-                    "id": entity.id.value,
-                    "game": jsons.dumps(asdict(entity)),
-                }
-            ]
-        }
-        response: Response = requests.post(self.url, headers = self.headers, json = data)
-        if not response.ok:
-            raise BizException(20001, f"insert game id: {entity.id.value} failed with response: {response}")
-
-    def update(self, entity: Game) -> None:
-        data = {
-            "Action": "Edit",
-            "Properties": self.properties,
-            "Rows": [
-                {
-                    "id": entity.id.value,
-                    "game": jsons.dumps(asdict(entity)),
-                }
+from bridgepy.game import GameId
+from collections import OrderedDict
+import copy
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+import logging
+import sqlite3
+import time
+
+from app.appsheet import AppSheetClient
+from app.codec import GameCodec, JsonsGameCodec, get_game_codec
+from app.event import GameEvent, GameEventStore, GameEventType, GameShape, derive_game_event, replay_game_events
+from app.exception import GameVersionConflictException
+from app.game import GameStatus, VersionedGame
+from app.metrics import Metrics, get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+EntityId = TypeVar("EntityId")
+EntityType = TypeVar("EntityType", bound = Entity)
+T = TypeVar("T")
+
+class AsyncDatastore(ABC, Generic[EntityId, EntityType]):
+
+    @abstractmethod
+    async def insert(self, entity: EntityType) -> None:
+        pass
+
+    @abstractmethod
+    async def update(self, entity: EntityType) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, id: EntityId) -> None:
+        pass
+
+    @abstractmethod
+    async def query(self, id: EntityId) -> EntityType | None:
+        pass
+
+    @abstractmethod
+    async def query_page(self, after: EntityId | None, limit: int) -> list[EntityType]:
+        """
+        Up to `limit` entities ordered by id, starting after the id `after`.
+        """
+        pass
+
+    async def insert_many(self, entities: list[EntityType]) -> None:
+        await asyncio.gather(*[self.insert(entity) for entity in entities])
+
+    async def update_many(self, entities: list[EntityType]) -> None:
+        results = await asyncio.gather(*[self.update(entity) for entity in entities], return_exceptions = True)
+        conflicts = [entity.id for entity, result in zip(entities, results) if isinstance(result, GameVersionConflictException)]
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, GameVersionConflictException):
+                raise result
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def delete_many(self, ids: list[EntityId]) -> None:
+        await asyncio.gather(*[self.delete(id) for id in ids])
+
+    async def query_many(self, ids: list[EntityId]) -> list[EntityType | None]:
+        return list(await asyncio.gather(*[self.query(id) for id in ids]))
+
+    async def start(self) -> None:
+        pass
+
+    async def warm_up(self) -> None:
+        """
+        Opens connections ahead of the first request. Raises `BizException` while the store is unreachable.
+        """
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class GameAppSheetDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Game store on an AppSheet table with two columns, `id` and `game`.
+    """
+
+    def __init__(
+        self,
+        appsheet: AppSheetClient,
+        table: str,
+        codec: GameCodec | None = None,
+        check_version: bool = True,
+        warm_up_connections: int = 1,
+    ) -> None:
+        self.appsheet = appsheet
+        self.table = table
+        self.codec: GameCodec = codec if codec is not None else JsonsGameCodec()
+        self.check_version = check_version
+        self.warm_up_connections = warm_up_connections
+
+    async def insert(self, entity: VersionedGame) -> None:
+        await self.insert_many([entity])
+
+    async def update(self, entity: VersionedGame) -> None:
+        await self.update_many([entity])
+
+    async def delete(self, id: GameId) -> None:
+        await self.delete_many([id])
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        return (await self.query_many([id]))[0]
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        rows = [{"id": entity.id.value, "game": self.codec.encode(entity)} for entity in entities]
+        await self.appsheet.rows(self.table, "Add", rows, 20001, f"insert game ids: {self.__ids(entities)}")
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        conflicts: list[GameId] = []
+        if self.check_version:
+            # AppSheet has no conditional Edit, so this narrows rather than closes the race across workers
+            currents = await self.query_many([entity.id for entity in entities])
+            conflicts = [
+                entity.id for entity, current in zip(entities, currents) if current is not None and current.version >= entity.version
             ]
-        }
-        response: Response = requests.post(self.url, headers = self.headers, json = data)
-        if not response.ok:
-            raise BizException(20002, f"update game id: {entity.id.value} failed with response: {response}")
-
-    def delete(self, id: GameId) -> None:
-        data = {
-            "Action": "Delete",
-            "Rows": [{"id": id.value}]
-        }
-        response: Response = requests.post(self.url, headers = self.headers, json = data)
-        if not response.ok:
-            raise BizException(20003, f"delete game id: {id.value} failed with response: {response}")
-
-    def query(self, id: GameId) -> Game | None:
-        data = {
-            "Action": "Find",
-            "Rows": [{"id": id.value}]
-        }
-        response: Response = requests.post(self.url, headers = self.headers, json = data)
-        if not response.ok:
-            raise BizException(20004, f"query game id: {id.value} failed with response: {response}")
-        games = self.__parse_list(response)
-        if len(games) == 0:
-            return None
-        return games[0]
+            entities = [entity for entity in entities if entity.id not in conflicts]
+        rows = [{"id": entity.id.value, "game": self.codec.encode(entity)} for entity in entities]
+        await self.appsheet.rows(self.table, "Edit", rows, 20002, f"update game ids: {self.__ids(entities)}")
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        rows = [{"id": id.value} for id in ids]
+        await self.appsheet.rows(self.table, "Delete", rows, 20003, f"delete game ids: {[id.value for id in ids]}")
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        rows = [{"id": id.value} for id in ids]
+        found = await self.appsheet.rows(self.table, "Find", rows, 20004, f"query game ids: {[id.value for id in ids]}")
+        games = {game.id.value: game for game in self.__decode(found)}
+        return [games.get(id.value) for id in ids]
 
-    def __parse_list(self, response: Response) -> list[Game]:
-        body = response.json()
-        if type(body) is not list:
-            return []
-        return [jsons.load(jsons.loads(row["game"]), Game) for row in body]
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        description = f"query games after id: {None if after is None else after.value}"
+        condition = "TRUE" if after is None else "[id] > " + self.appsheet.text(after.value, 20004, description)
+        selector = f"Top(OrderBy(Filter({self.table}, {condition}), [id]), {limit})"
+        found = await self.appsheet.find(self.table, selector, 20004, description)
+        # the cursor is applied here too, a page must never repeat the ids before it whatever AppSheet did with the selector
+        games = [game for game in self.__decode(found) if after is None or game.id.value > after.value]
+        return sorted(games, key = lambda game: game.id.value)[:limit]
 
-class GameLocalDataStore(Datastore[GameId, Game]):
+    async def warm_up(self) -> None:
+        await self.appsheet.warm_up(self.table, self.warm_up_connections)
+
+    async def close(self) -> None:
+        await self.appsheet.close()
+
+    def __ids(self, entities: list[VersionedGame]) -> list[str]:
+        return [entity.id.value for entity in entities]
+
+    def __decode(self, rows: list[dict[str, Any]]) -> list[VersionedGame]:
+        return [self.codec.decode(row["game"]) for row in rows]
+
+class GameLocalDataStore(AsyncDatastore[GameId, VersionedGame]):
 
     def __init__(self) -> None:
-        self.games: dict[str, Game] = {}
+        self.games: dict[str, VersionedGame] = {}
 
-    def insert(self, entity: Game) -> None:
-        if self.query(entity.id) is not None:
+    async def insert(self, entity: VersionedGame) -> None:
+        if await self.query(entity.id) is not None:
             return
         self.games.update({entity.id.value: entity})
 
-    def update(self, entity: Game) -> None:
-        if self.query(entity.id) is None:
+    async def update(self, entity: VersionedGame) -> None:
+        current = await self.query(entity.id)
+        if current is None:
             return
+        if current is not entity and current.version >= entity.version:
+            raise GameVersionConflictException([entity.id])
         self.games.update({entity.id.value: entity})
 
-    def delete(self, id: GameId) -> None:
-        if self.query(id) is None:
+    async def delete(self, id: GameId) -> None:
+        if await self.query(id) is None:
             return
         self.games.pop(id.value)
 
-    def query(self, id: GameId) -> Game | None:
+    async def query(self, id: GameId) -> VersionedGame | None:
         return self.games.get(id.value)
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        game_ids = sorted(game_id for game_id in self.games if after is None or game_id > after.value)
+        return [self.games[game_id] for game_id in game_ids[:limit]]
+
+class GameSQLiteDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Embedded game store on SQLite in WAL mode, one row per game in the compact encoding.
+
+    Statements are short and run on the event loop thread; status and updated_at are indexed so
+    games can be swept by status without a full scan.
+    """
+
+    CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS game ("
+        "id TEXT PRIMARY KEY, game TEXT NOT NULL, version INTEGER NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL)"
+    )
+    CREATE_STATUS_INDEX = "CREATE INDEX IF NOT EXISTS game_status_updated_at ON game (status, updated_at)"
+    CREATE_UPDATED_AT_INDEX = "CREATE INDEX IF NOT EXISTS game_updated_at ON game (updated_at)"
+    INSERT = "INSERT OR IGNORE INTO game (id, game, version, status, updated_at) VALUES (?, ?, ?, ?, ?)"
+    UPDATE = "UPDATE game SET game = ?, version = ?, status = ?, updated_at = ? WHERE id = ? AND version < ?"
+    DELETE = "DELETE FROM game WHERE id = ?"
+    QUERY = "SELECT game FROM game WHERE id = ?"
+    QUERY_EXISTS = "SELECT 1 FROM game WHERE id = ?"
+    QUERY_PAGE = "SELECT game FROM game WHERE id > ? ORDER BY id LIMIT ?"
+    QUERY_IDS_BY_STATUS = "SELECT id FROM game WHERE status = ? AND updated_at < ? ORDER BY updated_at LIMIT ?"
+
+    def __init__(self, path: str, codec: GameCodec | None = None) -> None:
+        self.codec: GameCodec = codec if codec is not None else get_game_codec("compact")
+        # statements only run on the event loop thread, but the backend is built lazily by whichever
+        # thread first uses it, so sqlite3 must not insist on the thread that opened the connection
+        self.connection = sqlite3.connect(path, isolation_level = None, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA busy_timeout = 5000")
+        self.connection.execute(self.CREATE_TABLE)
+        self.connection.execute(self.CREATE_STATUS_INDEX)
+        self.connection.execute(self.CREATE_UPDATED_AT_INDEX)
+
+    async def insert(self, entity: VersionedGame) -> None:
+        self.__execute(
+            self.INSERT,
+            (entity.id.value, self.codec.encode(entity), entity.version, entity.status().value, time.time()),
+            20001, f"insert game id: {entity.id.value}",
+        )
+
+    async def update(self, entity: VersionedGame) -> None:
+        cursor = self.__execute(
+            self.UPDATE,
+            (self.codec.encode(entity), entity.version, entity.status().value, time.time(), entity.id.value, entity.version),
+            20002, f"update game id: {entity.id.value}",
+        )
+        if cursor.rowcount > 0:
+            return
+        if self.__execute(self.QUERY_EXISTS, (entity.id.value,), 20002, f"update game id: {entity.id.value}").fetchone() is not None:
+            raise GameVersionConflictException([entity.id])
+
+    async def delete(self, id: GameId) -> None:
+        self.__execute(self.DELETE, (id.value,), 20003, f"delete game id: {id.value}")
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        now = time.time()
+        self.__execute_many(
+            self.INSERT,
+            [(entity.id.value, self.codec.encode(entity), entity.version, entity.status().value, now) for entity in entities],
+            20001, f"insert game ids: {[entity.id.value for entity in entities]}",
+        )
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        conflicts: list[GameId] = []
+        # one transaction, so the batch costs a single WAL commit; rows are still checked one by one
+        self.__execute("BEGIN", (), 20002, "update games")
+        try:
+            for entity in entities:
+                try:
+                    await self.update(entity)
+                except GameVersionConflictException:
+                    conflicts.append(entity.id)
+        finally:
+            self.__execute("COMMIT", (), 20002, "update games")
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        self.__execute_many(self.DELETE, [(id.value,) for id in ids], 20003, f"delete game ids: {[id.value for id in ids]}")
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        rows = self.__execute(
+            f"SELECT id, game FROM game WHERE id IN ({', '.join('?' * len(ids))})",
+            tuple(id.value for id in ids),
+            20004, f"query game ids: {[id.value for id in ids]}",
+        ).fetchall() if len(ids) > 0 else []
+        games = {id: game for id, game in rows}
+        return [None if id.value not in games else self.codec.decode(games[id.value]) for id in ids]
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        row = self.__execute(self.QUERY, (id.value,), 20004, f"query game id: {id.value}").fetchone()
+        if row is None:
+            return None
+        return self.codec.decode(row[0])
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        rows = self.__execute(
+            self.QUERY_PAGE, ("" if after is None else after.value, limit),
+            20004, f"query games after id: {None if after is None else after.value}",
+        ).fetchall()
+        return [self.codec.decode(row[0]) for row in rows]
+
+    async def query_ids_by_status(self, status: GameStatus, updated_before: float, limit: int = 100) -> list[GameId]:
+        rows = self.__execute(
+            self.QUERY_IDS_BY_STATUS, (status.value, updated_before, limit), 20004, f"query game ids by status: {status.value}",
+        ).fetchall()
+        return [GameId(row[0]) for row in rows]
+
+    async def close(self) -> None:
+        self.connection.close()
+
+    def __execute(self, sql: str, parameters: tuple, code: int, description: str) -> sqlite3.Cursor:
+        try:
+            return self.connection.execute(sql, parameters)
+        except sqlite3.Error as e:
+            raise BizException(code, f"{description} failed with error: {e!r}")
+
+    def __execute_many(self, sql: str, parameters: list[tuple], code: int, description: str) -> None:
+        try:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany(sql, parameters)
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            raise BizException(code, f"{description} failed with error: {e!r}")
+
+class GameEventSourcedDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Game datastore keeping every move in an append only event log, with the game row as a periodic snapshot.
+
+    An update appends one small event (a join, bid, partner, card or reset vote) instead of rewriting
+    the whole game, and the snapshot store is only written every `snapshot_interval` versions, on a
+    status change, or when the change cannot be replayed (deals are random so they are logged as
+    snapshots). Reads load the snapshot and replay the newer events on top. The event log also checks
+    versions: a second event for the same game version is a version conflict.
+    """
+
+    def __init__(
+        self,
+        snapshots: AsyncDatastore[GameId, VersionedGame],
+        events: GameEventStore,
+        codec: GameCodec | None = None,
+        snapshot_interval: int = 16,
+        max_size: int = 10000,
+    ) -> None:
+        self.snapshots = snapshots
+        self.events = events
+        self.codec: GameCodec = codec if codec is not None else get_game_codec("compact")
+        self.snapshot_interval = snapshot_interval
+        self.max_size = max_size
+        # shape of the last saved version of each game and the version its snapshot row is at
+        self.shapes: OrderedDict[str, tuple[GameShape, int]] = OrderedDict()
+
+    async def start(self) -> None:
+        await self.snapshots.start()
+
+    async def warm_up(self) -> None:
+        # an AppSheet event log shares the snapshot table's client and its pool
+        await self.snapshots.warm_up()
+
+    async def close(self) -> None:
+        await self.snapshots.close()
+        await self.events.close()
+
+    async def insert(self, entity: VersionedGame) -> None:
+        await self.insert_many([entity])
+
+    async def update(self, entity: VersionedGame) -> None:
+        await self.update_many([entity])
+
+    async def delete(self, id: GameId) -> None:
+        await self.delete_many([id])
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        return (await self.query_many([id]))[0]
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        await self.snapshots.insert_many(entities)
+        try:
+            await self.events.append([derive_game_event(None, entity, self.codec) for entity in entities])
+        except GameVersionConflictException as e:
+            # insert of an existing game is a no op, as in the other datastores
+            entities = [entity for entity in entities if entity.id not in e.game_ids]
+        for entity in entities:
+            self.__remember(entity, entity.version)
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        events = [derive_game_event(self.__shape(entity.id), entity, self.codec) for entity in entities]
+        conflicts: list[GameId] = []
+        try:
+            await self.events.append(events)
+        except GameVersionConflictException as e:
+            conflicts = e.game_ids
+            for game_id in conflicts:
+                self.shapes.pop(game_id.value, None)
+        saved = [(entity, event) for entity, event in zip(entities, events) if entity.id not in conflicts]
+        snapshots = [entity for entity, event in saved if self.__needs_snapshot(entity, event)]
+        snapshot_ids = {entity.id.value for entity in snapshots}
+        if len(snapshots) > 0:
+            try:
+                await self.snapshots.update_many(snapshots)
+            except GameVersionConflictException as e:
+                # a newer snapshot is already there, the event log has this version either way
+                logger.info(f"snapshot of game ids: {[game_id.value for game_id in e.game_ids]} already superseded")
+            except BizException as e:
+                # the moves are durable in the event log and reads replay them, only the snapshot is behind
+                logger.error(f"snapshot of game ids: {list(snapshot_ids)} failed, left at their last snapshot: {e.msg}")
+                snapshot_ids = set()
+        for entity, _ in saved:
+            known = self.shapes.get(entity.id.value)
+            if entity.id.value in snapshot_ids:
+                self.__remember(entity, entity.version)
+            elif known is not None:
+                self.__remember(entity, known[1])
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        # snapshot first, so a half done delete leaves no game rather than a game without its history
+        await self.snapshots.delete_many(ids)
+        await self.events.delete_many(ids)
+        for id in ids:
+            self.shapes.pop(id.value, None)
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        return await self.__replay(await self.snapshots.query_many(ids))
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        return [game for game in await self.__replay(await self.snapshots.query_page(after, limit)) if game is not None]
+
+    async def __replay(self, snapshots: list[VersionedGame | None]) -> list[VersionedGame | None]:
+        tails = await asyncio.gather(*[
+            self.events.query(snapshot.id, snapshot.version) for snapshot in snapshots if snapshot is not None
+        ])
+        events = iter(tails)
+        games: list[VersionedGame | None] = []
+        for snapshot in snapshots:
+            if snapshot is None:
+                games.append(None)
+                continue
+            # replay moves the snapshot game forward in place, so take its version first
+            snapshot_version = snapshot.version
+            game = replay_game_events(snapshot, next(events), self.codec)
+            self.__remember(game, snapshot_version)
+            games.append(game)
+        return games
+
+    def __needs_snapshot(self, entity: VersionedGame, event: GameEvent) -> bool:
+        known = self.shapes.get(entity.id.value)
+        return (
+            known is None
+            or event.type == GameEventType.SNAPSHOT
+            or entity.status() != known[0].status
+            or entity.version - known[1] >= self.snapshot_interval
+        )
+
+    def __shape(self, id: GameId) -> GameShape | None:
+        known = self.shapes.get(id.value)
+        return None if known is None else known[0]
+
+    def __remember(self, game: VersionedGame, snapshot_version: int) -> None:
+        self.shapes[game.id.value] = (GameShape.of(game), snapshot_version)
+        self.shapes.move_to_end(game.id.value)
+        while len(self.shapes) > self.max_size:
+            self.shapes.popitem(last = False)
+
+class GameCachedDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Write-behind cache in front of another game datastore.
+
+    Active games are kept in memory with LRU + TTL eviction and reads are served locally. While
+    backend calls fail, expired games are kept and served rather than failing the read.
+    Writes are buffered as dirty entries and flushed to the backend every `flush_interval`
+    seconds, or straight away when a game crosses a phase boundary (players joined, cards
+    dealt, auction finished, partner chosen, game finished). Dirty entries are always
+    flushed on close. A flush writes copies of the games as they were when it started, so a move
+    landing while it is in flight goes out with the next flush, and a version already flushed is
+    never sent again.
+
+    A flush can lose to a newer version written elsewhere after its moves were acknowledged. The
+    stored game is then read back into the cache, newer buffered moves built on the lost one are
+    dropped, and `on_conflict` is called with the stored game, e.g. to resync the game's clients.
+    """
+
+    def __init__(
+        self,
+        backend: AsyncDatastore[GameId, VersionedGame],
+        max_size: int = 1000,
+        ttl: float = 3600.0,
+        flush_interval: float = 1.0,
+        on_conflict: Callable[[VersionedGame], Awaitable[None]] | None = None,
+    ) -> None:
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.on_conflict = on_conflict
+        self.games: OrderedDict[str, tuple[VersionedGame, float]] = OrderedDict()
+        self.dirty: dict[str, tuple[str, VersionedGame]] = {}
+        self.phases: dict[str, tuple] = {}
+        # newest version of each game written to the backend by this cache
+        self.flushed: dict[str, int] = {}
+        # whether the last backend call failed; expired games are kept meanwhile to be served instead
+        self.backend_failing = False
+        self.flush_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.backend.start()
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.__flush_loop())
+
+    async def warm_up(self) -> None:
+        await self.backend.warm_up()
+
+    async def insert(self, entity: VersionedGame) -> None:
+        self.__put(entity)
+        self.dirty[entity.id.value] = ("Add", entity)
+        await self.__flush_on_phase_change(entity)
+
+    async def update(self, entity: VersionedGame) -> None:
+        cached = self.games.get(entity.id.value)
+        current = cached[0] if cached is not None else self.dirty.get(entity.id.value, (None, None))[1]
+        if current is not None and current is not entity and current.version >= entity.version:
+            raise GameVersionConflictException([entity.id])
+        self.__put(entity)
+        action = self.dirty[entity.id.value][0] if entity.id.value in self.dirty else "Edit"
+        self.dirty[entity.id.value] = (action, entity)
+        await self.__flush_on_phase_change(entity)
+
+    async def delete(self, id: GameId) -> None:
+        await self.delete_many([id])
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        stored: list[GameId] = []
+        for id in ids:
+            self.games.pop(id.value, None)
+            self.phases.pop(id.value, None)
+            self.flushed.pop(id.value, None)
+            pending = self.dirty.pop(id.value, None)
+            # a game whose Add was never flushed has no row to delete
+            if pending is None or pending[0] != "Add":
+                stored.append(id)
+        if len(stored) > 0:
+            await self.backend.delete_many(stored)
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        return (await self.query_many([id]))[0]
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        games: dict[str, VersionedGame | None] = {}
+        misses: dict[str, GameId] = {}
+        now = time.monotonic()
+        for id in ids:
+            cached = self.games.get(id.value)
+            if cached is not None and cached[1] > now:
+                # the TTL counts from the last access
+                self.__put(cached[0])
+                games[id.value] = cached[0]
+            elif id.value in self.dirty:
+                games[id.value] = self.dirty[id.value][1]
+                self.__put(games[id.value])
+            else:
+                misses[id.value] = id
+        if len(misses) == 0:
+            return [games[id.value] for id in ids]
+        # every miss in one backend call
+        try:
+            found = await self.backend.query_many(list(misses.values()))
+        except BizException as e:
+            self.backend_failing = True
+            expired = {game_id: self.games.get(game_id) for game_id in misses}
+            if any(cached is None for cached in expired.values()):
+                raise
+            # backend degraded, expired copies are better than failing the players
+            logger.warning(f"serving expired cached game ids: {list(misses)}, backend query failed: {e.msg}")
+            return [games[id.value] if id.value in games else expired[id.value][0] for id in ids]
+        self.backend_failing = False
+        for game in found:
+            if game is not None:
+                self.__put(game)
+                self.phases[game.id.value] = self.__phase(game)
+        games.update({game_id: game for game_id, game in zip(misses, found)})
+        return [games[id.value] for id in ids]
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        await self.flush()
+        games = await self.backend.query_page(after, limit)
+        # the backend may lag behind a cached game whose flush just failed, prefer the cached copy
+        return [self.games.get(game.id.value, (game, 0.0))[0] for game in games]
+
+    async def flush(self) -> None:
+        if len(self.dirty) == 0:
+            return
+        dirty, self.dirty = self.dirty, {}
+        await asyncio.gather(
+            self.__write_many("Add", self.__unflushed([game for action, game in dirty.values() if action == "Add"])),
+            self.__write_many("Edit", self.__unflushed([game for action, game in dirty.values() if action == "Edit"])),
+        )
+
+    async def close(self) -> None:
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+        await self.backend.close()
+
+    async def __flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # the loop is the only flusher of idle games, it must outlive any one flush
+                logger.error(f"write-behind flush failed: {e!r}")
+            self.__evict_expired()
+
+    async def __flush_on_phase_change(self, game: VersionedGame) -> None:
+        phase = self.__phase(game)
+        if self.phases.get(game.id.value) == phase:
+            return
+        self.phases[game.id.value] = phase
+        pending = self.dirty.pop(game.id.value, None)
+        if pending is not None:
+            await self.__write_many(pending[0], self.__unflushed([pending[1]]))
+
+    async def __write_many(self, action: str, games: list[VersionedGame]) -> None:
+        if len(games) == 0:
+            return
+        try:
+            if action == "Add":
+                await self.backend.insert_many(games)
+            else:
+                await self.backend.update_many(games)
+        except GameVersionConflictException as e:
+            conflicts = {game_id.value for game_id in e.game_ids} if len(e.game_ids) > 0 else {game.id.value for game in games}
+            self.__remember_flushed([game for game in games if game.id.value not in conflicts])
+            # a newer version of the game flushed by this cache in the meantime won the race, nothing was lost
+            await self.__resync([game.id for game in games if game.id.value in conflicts and not self.__is_flushed(game)])
+        except BizException as e:
+            self.backend_failing = True
+            logger.error(f"write-behind flush of game ids: {[game.id.value for game in games]} failed: {e.msg}")
+            # keep the writes for the next flush unless newer ones have already been buffered
+            for game in games:
+                self.dirty.setdefault(game.id.value, (action, game))
+        else:
+            self.backend_failing = False
+            self.__remember_flushed(games)
+
+    def __unflushed(self, games: list[VersionedGame]) -> list[VersionedGame]:
+        # copied as they are now: the bridge client changes the cached game in place, and a move landing
+        # while the write is in flight belongs to the next flush, not to this one
+        return [copy.deepcopy(game) for game in games if not self.__is_flushed(game)]
+
+    def __is_flushed(self, game: VersionedGame) -> bool:
+        return game.version <= self.flushed.get(game.id.value, -1)
+
+    def __remember_flushed(self, games: list[VersionedGame]) -> None:
+        for game in games:
+            self.flushed[game.id.value] = max(game.version, self.flushed.get(game.id.value, -1))
+
+    async def __resync(self, game_ids: list[GameId]) -> None:
+        if len(game_ids) == 0:
+            return
+        for game_id in game_ids:
+            self.games.pop(game_id.value, None)
+            self.phases.pop(game_id.value, None)
+            self.flushed.pop(game_id.value, None)
+            # buffered since the flush started, on top of the lost version
+            self.dirty.pop(game_id.value, None)
+        try:
+            games = await self.backend.query_many(game_ids)
+        except BizException as e:
+            logger.error(f"write-behind flush of game ids: {[game_id.value for game_id in game_ids]} lost to newer versions, reading them failed: {e.msg}")
+            return
+        for game_id, game in zip(game_ids, games):
+            logger.warning(
+                f"write-behind flush of game id: {game_id.value} lost to version {None if game is None else game.version}, resyncing the game"
+            )
+            if game is None:
+                continue
+            self.__put(game)
+            self.phases[game_id.value] = self.__phase(game)
+            if self.on_conflict is not None:
+                await self.on_conflict(game)
+
+    def __put(self, game: VersionedGame) -> None:
+        self.games[game.id.value] = (game, time.monotonic() + self.ttl)
+        self.games.move_to_end(game.id.value)
+        while len(self.games) > self.max_size:
+            game_id, _ = self.games.popitem(last = False)
+            if game_id not in self.dirty:
+                self.phases.pop(game_id, None)
+                self.flushed.pop(game_id, None)
+
+    def __evict_expired(self) -> None:
+        if self.backend_failing:
+            return
+        now = time.monotonic()
+        for game_id in [game_id for game_id, (_, expires_at) in self.games.items() if expires_at <= now]:
+            self.games.pop(game_id)
+            if game_id not in self.dirty:
+                self.phases.pop(game_id, None)
+                self.flushed.pop(game_id, None)
+
+    def __phase(self, game: VersionedGame) -> tuple:
+        return (len(game.player_ids), game.status())
+
+class GameBatchingDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Micro-batching writer in front of another game datastore.
+
+    Single inserts and updates wait up to `window` seconds and are then sent together through
+    the backend's bulk path, so concurrent moves across games share one upstream call. Each
+    caller still gets its own outcome, including version conflicts. Reads and deletes pass through.
+    """
+
+    def __init__(self, backend: AsyncDatastore[GameId, VersionedGame], window: float = 0.05) -> None:
+        self.backend = backend
+        self.window = window
+        self.pending: dict[str, dict[str, tuple[VersionedGame, asyncio.Future]]] = {"Add": {}, "Edit": {}}
+        self.flush_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def warm_up(self) -> None:
+        await self.backend.warm_up()
+
+    async def insert(self, entity: VersionedGame) -> None:
+        await self.__enqueue("Add", entity)
+
+    async def update(self, entity: VersionedGame) -> None:
+        await self.__enqueue("Edit", entity)
+
+    async def delete(self, id: GameId) -> None:
+        await self.backend.delete(id)
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        return await self.backend.query(id)
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        await self.backend.insert_many(entities)
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        await self.backend.update_many(entities)
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        await self.backend.delete_many(ids)
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        return await self.backend.query_many(ids)
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        return await self.backend.query_page(after, limit)
+
+    async def flush(self) -> None:
+        pending, self.pending = self.pending, {"Add": {}, "Edit": {}}
+        await asyncio.gather(*[self.__write_many(action, list(games.values())) for action, games in pending.items()])
+
+    async def close(self) -> None:
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        await self.backend.close()
+
+    async def __enqueue(self, action: str, entity: VersionedGame) -> None:
+        superseded = self.pending[action].get(entity.id.value)
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending[action][entity.id.value] = (entity, future)
+        if superseded is not None:
+            # only one row per game can go out in a call, the older write loses as it would upstream
+            superseded[1].set_exception(GameVersionConflictException([entity.id]))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.__flush_after_window())
+        await future
+
+    async def __flush_after_window(self) -> None:
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def __write_many(self, action: str, pending: list[tuple[VersionedGame, asyncio.Future]]) -> None:
+        if len(pending) == 0:
+            return
+        conflicts: list[GameId] = []
+        error: BaseException | None = None
+        try:
+            if action == "Add":
+                await self.backend.insert_many([entity for entity, _ in pending])
+            else:
+                await self.backend.update_many([entity for entity, _ in pending])
+        except GameVersionConflictException as e:
+            conflicts = e.game_ids
+        except Exception as e:
+            error = e
+        conflict_ids = {game_id.value for game_id in conflicts}
+        for entity, future in pending:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif entity.id.value in conflict_ids:
+                future.set_exception(GameVersionConflictException([entity.id]))
+            else:
+                future.set_result(None)
+
+class GameSingleFlightDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Coalesces concurrent reads of the same game into one backend query (fetch and decode), shared
+    by every caller that arrives while it is in flight. A write to the game detaches the in-flight
+    read so later readers do not get the game from before the write.
+    """
+
+    def __init__(self, backend: AsyncDatastore[GameId, VersionedGame], metrics: Metrics | None = None) -> None:
+        self.backend = backend
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.queries: dict[str, asyncio.Future] = {}
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def warm_up(self) -> None:
+        await self.backend.warm_up()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    async def insert(self, entity: VersionedGame) -> None:
+        self.queries.pop(entity.id.value, None)
+        await self.backend.insert(entity)
+
+    async def update(self, entity: VersionedGame) -> None:
+        self.queries.pop(entity.id.value, None)
+        await self.backend.update(entity)
+
+    async def delete(self, id: GameId) -> None:
+        self.queries.pop(id.value, None)
+        await self.backend.delete(id)
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        query = self.queries.get(id.value)
+        if query is not None:
+            self.metrics.single_flight_queries.inc(("shared",))
+            return await asyncio.shield(query)
+        self.metrics.single_flight_queries.inc(("leader",))
+        query = asyncio.ensure_future(self.backend.query(id))
+        self.queries[id.value] = query
+        query.add_done_callback(lambda _: self.__forget(id.value, query))
+        return await asyncio.shield(query)
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        return await self.backend.query_page(after, limit)
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        for entity in entities:
+            self.queries.pop(entity.id.value, None)
+        await self.backend.insert_many(entities)
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        for entity in entities:
+            self.queries.pop(entity.id.value, None)
+        await self.backend.update_many(entities)
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        for id in ids:
+            self.queries.pop(id.value, None)
+        await self.backend.delete_many(ids)
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        return await self.backend.query_many(ids)
+
+    def __forget(self, game_id: str, query: asyncio.Future) -> None:
+        if self.queries.get(game_id) is query:
+            del self.queries[game_id]
+
+class GameInstrumentedDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """
+    Records latency and BizException codes of every call into another game datastore, labelled `name`.
+    """
+
+    def __init__(self, backend: AsyncDatastore[GameId, VersionedGame], name: str, metrics: Metrics | None = None) -> None:
+        self.backend = backend
+        self.name = name
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def warm_up(self) -> None:
+        await self.backend.warm_up()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    async def insert(self, entity: VersionedGame) -> None:
+        await self.__record("insert", self.backend.insert(entity))
+
+    async def update(self, entity: VersionedGame) -> None:
+        await self.__record("update", self.backend.update(entity))
+
+    async def delete(self, id: GameId) -> None:
+        await self.__record("delete", self.backend.delete(id))
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        return await self.__record("query", self.backend.query(id))
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        return await self.__record("query_page", self.backend.query_page(after, limit))
+
+    async def insert_many(self, entities: list[VersionedGame]) -> None:
+        await self.__record("insert_many", self.backend.insert_many(entities))
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        await self.__record("update_many", self.backend.update_many(entities))
+
+    async def delete_many(self, ids: list[GameId]) -> None:
+        await self.__record("delete_many", self.backend.delete_many(ids))
+
+    async def query_many(self, ids: list[GameId]) -> list[VersionedGame | None]:
+        return await self.__record("query_many", self.backend.query_many(ids))
+
+    async def __record(self, operation: str, call: Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try:
+            return await call
+        except BizException as e:
+            self.metrics.datastore_errors.inc((self.name, operation, str(e.code)))
+            raise
+        finally:
+            self.metrics.datastore_operation_duration.observe(time.perf_counter() - start, (self.name, operation))
@@ -0,0 +1,274 @@
+from abc import ABC, abstractmethod
+import asyncio
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+from bridgepy.player import PlayerBid, PlayerId, PlayerTrick
+from dataclasses import dataclass
+from enum import Enum
+import orjson
+import sqlite3
+import time
+from typing import Any
+
+from app.appsheet import AppSheetClient
+from app.codec import BIDS, CARDS, GameCodec
+from app.exception import GameVersionConflictException
+from app.game import GameStatus, VersionedGame
+
+
+class GameEventType(Enum):
+    SNAPSHOT = "SNAPSHOT"
+    JOIN = "JOIN"
+    BID = "BID"
+    PARTNER = "PARTNER"
+    TRICK = "TRICK"
+    RESET = "RESET"
+
+@dataclass
+class GameEvent:
+    """
+    One saved change of a game, taking it to `version`.
+
+    `value` is the bid (`None` for a pass) or card played, or for `SNAPSHOT` the whole encoded game.
+    Deals are random, so anything that deals (the fourth join, an all pass auction, the last reset
+    vote) is recorded as a `SNAPSHOT` rather than replayed.
+    """
+    game_id: str
+    version: int
+    type: GameEventType
+    player_id: str | None = None
+    value: str | None = None
+
+    def apply(self, game: VersionedGame | None, codec: GameCodec) -> VersionedGame:
+        if self.type == GameEventType.SNAPSHOT:
+            return codec.decode(self.value)
+        player_id = PlayerId(self.player_id)
+        if self.type == GameEventType.JOIN:
+            game.add_player(player_id)
+        elif self.type == GameEventType.BID:
+            game.bid(PlayerBid(player_id = player_id, bid = None if self.value is None else BIDS[self.value]))
+        elif self.type == GameEventType.PARTNER:
+            game.choose_partner(player_id, CARDS[self.value])
+        elif self.type == GameEventType.TRICK:
+            game.trick(PlayerTrick(player_id = player_id, trick = CARDS[self.value]))
+        elif self.type == GameEventType.RESET:
+            game.reset(player_id)
+        game.version = self.version
+        return game
+
+    def encode(self) -> str:
+        return orjson.dumps({"t": self.type.value, "p": self.player_id, "x": self.value}).decode()
+
+    @staticmethod
+    def decode(game_id: str, version: int, data: str) -> "GameEvent":
+        doc: dict[str, Any] = orjson.loads(data)
+        return GameEvent(game_id = game_id, version = version, type = GameEventType(doc["t"]), player_id = doc["p"], value = doc["x"])
+
+@dataclass(frozen = True)
+class GameShape:
+    """
+    What a saved game looked like, enough to tell which single move a newer game is.
+    """
+    version: int
+    players: int
+    bids: int
+    partner: bool
+    cards_played: int
+    reset_votes: frozenset[str]
+    status: GameStatus
+
+    @staticmethod
+    def of(game: VersionedGame) -> "GameShape":
+        return GameShape(
+            version = game.version,
+            players = len(game.player_ids),
+            bids = len(game.bids),
+            partner = game.partner is not None,
+            cards_played = sum(len(game_trick.player_tricks) for game_trick in game.tricks),
+            reset_votes = frozenset(player_id.value for player_id in game.reset_votes),
+            status = game.status(),
+        )
+
+def derive_game_event(before: GameShape | None, game: VersionedGame, codec: GameCodec) -> GameEvent:
+    """
+    The event taking a game shaped like `before` to `game`, or a `SNAPSHOT` of `game` when it is
+    not exactly one replayable move on from it.
+    """
+    snapshot = GameEvent(game.id.value, game.version, GameEventType.SNAPSHOT, value = codec.encode(game))
+    if before is None or game.version != before.version + 1:
+        return snapshot
+    after = GameShape.of(game)
+    if after == GameShape(before.version + 1, before.players + 1, before.bids, before.partner, before.cards_played, before.reset_votes, after.status):
+        if game.dealt():
+            return snapshot
+        return GameEvent(game.id.value, game.version, GameEventType.JOIN, player_id = game.player_ids[-1].value)
+    if after == GameShape(before.version + 1, before.players, before.bids + 1, before.partner, before.cards_played, before.reset_votes, after.status):
+        player_bid = game.bids[-1]
+        bid = None if player_bid.bid is None else player_bid.bid.__repr__()
+        return GameEvent(game.id.value, game.version, GameEventType.BID, player_id = player_bid.player_id.value, value = bid)
+    if not before.partner and after == GameShape(
+        before.version + 1, before.players, before.bids, True, before.cards_played, before.reset_votes, after.status,
+    ):
+        player_id = game.bid_winner().player_id
+        return GameEvent(game.id.value, game.version, GameEventType.PARTNER, player_id = player_id.value, value = game.partner.__repr__())
+    if after == GameShape(before.version + 1, before.players, before.bids, before.partner, before.cards_played + 1, before.reset_votes, after.status):
+        player_trick = game.tricks[-1].player_tricks[-1]
+        return GameEvent(
+            game.id.value, game.version, GameEventType.TRICK, player_id = player_trick.player_id.value, value = player_trick.trick.__repr__(),
+        )
+    voters = after.reset_votes - before.reset_votes
+    if len(voters) == 1 and before.reset_votes < after.reset_votes and after == GameShape(
+        before.version + 1, before.players, before.bids, before.partner, before.cards_played, after.reset_votes, after.status,
+    ):
+        return GameEvent(game.id.value, game.version, GameEventType.RESET, player_id = next(iter(voters)))
+    return snapshot
+
+def replay_game_events(game: VersionedGame | None, events: list[GameEvent], codec: GameCodec) -> VersionedGame | None:
+    """
+    Applies `events` in version order on top of `game`, stopping at the first gap.
+    """
+    for event in sorted(events, key = lambda event: event.version):
+        if event.type != GameEventType.SNAPSHOT and (game is None or event.version != game.version + 1):
+            break
+        game = event.apply(game, codec)
+    return game
+
+class GameEventStore(ABC):
+    """
+    Append only log of game events, keyed by game id and version.
+    """
+
+    @abstractmethod
+    async def append(self, events: list[GameEvent]) -> None:
+        """
+        Saves `events`, raising a version conflict naming the games whose event version was already taken.
+        Events of the other games are still saved.
+        """
+        pass
+
+    @abstractmethod
+    async def query(self, game_id: GameId, after_version: int) -> list[GameEvent]:
+        """
+        Events of the game newer than `after_version`, in version order.
+        """
+        pass
+
+    @abstractmethod
+    async def delete_many(self, game_ids: list[GameId]) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+class GameEventSQLiteStore(GameEventStore):
+    """
+    Game event log on a `game_event` table in the SQLite file of the `game` snapshot table.
+
+    Appending an event also moves the game row's `updated_at`, so the reaper's status index ages a
+    game by its last move rather than by its last snapshot.
+    """
+
+    CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS game_event ("
+        "game_id TEXT NOT NULL, version INTEGER NOT NULL, event TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (game_id, version))"
+    )
+    INSERT = "INSERT OR IGNORE INTO game_event (game_id, version, event, created_at) VALUES (?, ?, ?, ?)"
+    DELETE = "DELETE FROM game_event WHERE game_id = ?"
+    QUERY = "SELECT version, event FROM game_event WHERE game_id = ? AND version > ? ORDER BY version"
+    TOUCH_GAME = "UPDATE game SET updated_at = ? WHERE id = ? AND updated_at < ?"
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path, isolation_level = None, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA busy_timeout = 5000")
+        self.connection.execute(self.CREATE_TABLE)
+
+    async def append(self, events: list[GameEvent]) -> None:
+        conflicts: list[GameId] = []
+        now = time.time()
+        try:
+            self.connection.execute("BEGIN")
+            try:
+                for event in events:
+                    cursor = self.connection.execute(self.INSERT, (event.game_id, event.version, event.encode(), now))
+                    if cursor.rowcount == 0:
+                        conflicts.append(GameId(event.game_id))
+                    else:
+                        self.connection.execute(self.TOUCH_GAME, (now, event.game_id, now))
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            raise BizException(20002, f"append game events of game ids: {[event.game_id for event in events]} failed with error: {e!r}")
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def query(self, game_id: GameId, after_version: int) -> list[GameEvent]:
+        try:
+            rows = self.connection.execute(self.QUERY, (game_id.value, after_version)).fetchall()
+        except sqlite3.Error as e:
+            raise BizException(20004, f"query game events of game id: {game_id.value} failed with error: {e!r}")
+        return [GameEvent.decode(game_id.value, version, event) for version, event in rows]
+
+    async def delete_many(self, game_ids: list[GameId]) -> None:
+        try:
+            self.connection.executemany(self.DELETE, [(game_id.value,) for game_id in game_ids])
+        except sqlite3.Error as e:
+            raise BizException(20003, f"delete game events of game ids: {[game_id.value for game_id in game_ids]} failed with error: {e!r}")
+
+    async def close(self) -> None:
+        self.connection.close()
+
+class GameEventAppSheetStore(GameEventStore):
+    """
+    Game event log on an AppSheet table with the columns `id` (`<game id>:<version>`), `gameId`,
+    `version` and `event`.
+    """
+
+    def __init__(self, appsheet: AppSheetClient, table: str, check_version: bool = True) -> None:
+        self.appsheet = appsheet
+        self.table = table
+        self.check_version = check_version
+
+    async def append(self, events: list[GameEvent]) -> None:
+        conflicts: list[GameId] = []
+        if self.check_version:
+            # AppSheet has no conditional Add, so this narrows rather than closes the race across workers
+            found = await self.appsheet.rows(
+                self.table, "Find", [{"id": self.__id(event.game_id, event.version)} for event in events],
+                20002, f"check game events of game ids: {[event.game_id for event in events]}",
+            )
+            taken = {row["id"] for row in found}
+            conflicts = [GameId(event.game_id) for event in events if self.__id(event.game_id, event.version) in taken]
+            events = [event for event in events if self.__id(event.game_id, event.version) not in taken]
+        rows = [
+            {"id": self.__id(event.game_id, event.version), "gameId": event.game_id, "version": event.version, "event": event.encode()}
+            for event in events
+        ]
+        await self.appsheet.rows(self.table, "Add", rows, 20002, f"append game events of game ids: {[event.game_id for event in events]}")
+        if len(conflicts) > 0:
+            raise GameVersionConflictException(conflicts)
+
+    async def query(self, game_id: GameId, after_version: int) -> list[GameEvent]:
+        rows = await self.__find(game_id, after_version, 20004, f"query game events of game id: {game_id.value}")
+        return [GameEvent.decode(game_id.value, int(row["version"]), row["event"]) for row in rows]
+
+    async def delete_many(self, game_ids: list[GameId]) -> None:
+        description = f"delete game events of game ids: {[game_id.value for game_id in game_ids]}"
+        found = await asyncio.gather(*[self.__find(game_id, 0, 20003, description) for game_id in game_ids])
+        await self.appsheet.rows(self.table, "Delete", [{"id": row["id"]} for rows in found for row in rows], 20003, description)
+
+    async def close(self) -> None:
+        await self.appsheet.close()
+
+    async def __find(self, game_id: GameId, after_version: int, code: int, description: str) -> list[dict[str, Any]]:
+        condition = "[gameId] = " + self.appsheet.text(game_id.value, code, description)
+        selector = f"OrderBy(Filter({self.table}, AND({condition}, [version] > {after_version})), [version])"
+        rows = await self.appsheet.find(self.table, selector, code, description)
+        rows = [row for row in rows if row["gameId"] == game_id.value and int(row["version"]) > after_version]
+        return sorted(rows, key = lambda row: int(row["version"]))
+
+    def __id(self, game_id: str, version: int) -> str:
+        return f"{game_id}:{version}"
@@ -0,0 +1,27 @@
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+
+
+class GameVersionConflictException(BizException):
+    def __init__(self, game_ids: list[GameId] | None = None):
+        super().__init__(20005, "Game was updated concurrently, please retry!")
+        self.game_ids: list[GameId] = game_ids if game_ids is not None else []
+
+class BackendNotReadyException(BizException):
+    def __init__(self):
+        super().__init__(20006, "Service is warming up, please retry!")
+
+class GameActionNotAppliedException(BizException):
+    """
+    The result of an action of a batch that succeeded on its own but was rolled back with the batch.
+    """
+    def __init__(self):
+        super().__init__(20007, "Not applied, a later action of the batch failed!")
+
+class GameActionFailedException(BizException):
+    """
+    An action of a batch failed, carrying its own code and message along with its index in the batch.
+    """
+    def __init__(self, index: int, cause: BizException):
+        super().__init__(cause.code, cause.msg)
+        self.index = index
@@ -0,0 +1,34 @@
+from bridgepy.game import Game
+from dataclasses import dataclass
+from enum import Enum
+
+
+class GameStatus(Enum):
+    WAITING = "WAITING"
+    BIDDING = "BIDDING"
+    CHOOSING_PARTNER = "CHOOSING_PARTNER"
+    PLAYING = "PLAYING"
+    FINISHED = "FINISHED"
+
+@dataclass
+class VersionedGame(Game):
+    """
+    bridgepy `Game` with a version that is bumped on every saved mutation.
+
+    `instance` is a random id given when the game is created. A game deleted and created again under
+    the same id restarts at version 0, so anything keyed by version is keyed by instance too.
+    Games created before it existed have an empty one.
+    """
+    version: int = 0
+    instance: str = ""
+
+    def status(self) -> GameStatus:
+        if not self.dealt():
+            return GameStatus.WAITING
+        if not self.game_bid_ready():
+            return GameStatus.BIDDING
+        if self.partner is None:
+            return GameStatus.CHOOSING_PARTNER
+        if not self.game_finished():
+            return GameStatus.PLAYING
+        return GameStatus.FINISHED
@@ -1,35 +1,52 @@
 import asyncio
 from bridgepy.bid import Bid
-from bridgepy.bridge import BridgeClient
 from bridgepy.card import Card
-from bridgepy.datastore import Datastore
-from bridgepy.exception import BizException
-from bridgepy.game import Game, GameId
-from bridgepy.player import PlayerId
-from fastapi import FastAPI, Request, WebSocket
+from bridgepy.exception import BizException, BridgeGameNotFoundException, GamePlayerNotFound
+from bridgepy.game import GameId
+from bridgepy.player import PlayerAction, PlayerBid, PlayerId, PlayerTrick
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import logging
+import orjson
+from typing import Callable
 
+from app.backend import get_backend
 from app.config import get_settings
-from app.dataconverter import get_bid_request_builder, get_game_snapshot_response_assembler
-from app.datastore import GameAppSheetDatastore, GameLocalDataStore
+from app.dataconverter import get_bid_request_builder, get_game_snapshot_serializer
+from app.exception import BackendNotReadyException, GameActionFailedException, GameActionNotAppliedException
+from app.game import GameStatus, VersionedGame
 from app.message import Message, MessageType
-from app.request import BidRequest, CreateRequest, DeleteRequest, JoinRequest, PartnerRequest, ResetRequest, TrickRequest, ViewRequest
-from app.response import BaseResponse, GamePlayerSnapshotResponse, SuccessResponse
-from app.websocket import GameWebSocketManager
+from app.metrics import MetricsMiddleware, get_metrics
+from app.request import (
+    ActionsRequest, BidRequest, CreateRequest, DeleteBatchRequest, DeleteRequest, GameActionRequest, JoinRequest, ListRequest,
+    PartnerRequest, ResetRequest, TrickRequest, ViewBatchRequest, ViewRequest,
+)
+from app.response import (
+    BaseResponse, GameActionResultResponse, GameActionsResponse, GameListResponse, GamePlayerSnapshotResponse, GameSummaryResponse,
+    GameViewBatchItemResponse, HealthResponse, NotModifiedResponse, SuccessResponse,
+)
+from app.websocket import GameSpectatorConnection, GameWebSocketConnection
 
 
 settings = get_settings()
-game_datastore: Datastore[GameId, Game] = GameAppSheetDatastore(
-    settings.app_sheet_app_id,
-    settings.app_sheet_game_table,
-    settings.app_sheet_app_access_key,
-) if settings.use_app_sheet else GameLocalDataStore()
-bridge_client = BridgeClient(game_datastore)
-game_socket_manager = GameWebSocketManager(bridge_client)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.basicConfig(
+        level = logging.INFO,
+        format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    await get_backend().start()
+    yield
+    await get_backend().close()
+
+app = FastAPI(lifespan = lifespan)
+
+if settings.use_metrics:
+    app.add_middleware(MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,52 +58,162 @@ app.add_middleware(
 
 @app.post("/game/create", response_model_exclude_none = True)
 async def create_game(request: CreateRequest) -> BaseResponse:
-    bridge_client.create_game(PlayerId(request.playerId), GameId(request.gameId))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.create_game(PlayerId(request.playerId), GameId(request.gameId))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
 @app.post("/game/join", response_model_exclude_none = True)
 async def join_game(request: JoinRequest) -> BaseResponse:
-    bridge_client.join_game(PlayerId(request.playerId), GameId(request.gameId))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.join_game(PlayerId(request.playerId), GameId(request.gameId))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
-@app.post("/game/view", response_model_exclude_none = False)
-async def view_game(request: ViewRequest) -> BaseResponse[GamePlayerSnapshotResponse]:
-    game = bridge_client.view_game(PlayerId(request.playerId), GameId(request.gameId))
-    return SuccessResponse(data = get_game_snapshot_response_assembler().convert(game))
+@app.post("/game/view", response_model = BaseResponse[GamePlayerSnapshotResponse], response_model_exclude_none = False)
+async def view_game(request: ViewRequest, if_none_match: str | None = Header(default = None)) -> Response:
+    player_id = PlayerId(request.playerId)
+    since_instance, since_version = None, request.sinceVersion
+    if since_version is None and if_none_match is not None:
+        since_instance, since_version = parse_game_etag(if_none_match)
+    if since_version is not None and request.waitSeconds is not None and request.waitSeconds > 0:
+        wait_seconds = min(request.waitSeconds, settings.view_max_wait_seconds)
+        game = await get_backend().bridge_client.wait_game(GameId(request.gameId), since_version, wait_seconds, since_instance)
+    else:
+        game = await get_backend().bridge_client.find_game(GameId(request.gameId))
+    if player_id not in game.player_ids:
+        raise GamePlayerNotFound()
+    etag = game_etag(game)
+    if game.version == since_version and since_instance in (None, game.instance):
+        if request.sinceVersion is None:
+            return Response(status_code = 304, headers = {"ETag": etag})
+        return JSONResponse(content = NotModifiedResponse().model_dump(by_alias = True, exclude_none = True), headers = {"ETag": etag})
+    snapshot: str = get_game_snapshot_serializer().serialize(game, player_id)
+    return Response(content = f'{{"code":0,"msg":"success","data":{snapshot}}}', media_type = "application/json", headers = {"ETag": etag})
+
+def game_etag(game: VersionedGame) -> str:
+    # the version alone repeats when a game is deleted and created again under the same id
+    return f'"{game.instance}.{game.version}"'
+
+def parse_game_etag(etag: str) -> tuple[str | None, int | None]:
+    instance, _, version = etag.strip().removeprefix("W/").strip('"').rpartition(".")
+    if not version.isdigit():
+        return None, None
+    return instance, int(version)
 
 @app.post("/game/bid", response_model_exclude_none = True)
 async def bid(request: BidRequest) -> BaseResponse:
     bid: Bid | None = get_bid_request_builder().convert(request.bid)
-    bridge_client.bid(PlayerId(request.playerId), GameId(request.gameId), bid)
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.bid(PlayerId(request.playerId), GameId(request.gameId), bid)
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
 @app.post("/game/partner", response_model_exclude_none = True)
 async def choose_partner(request: PartnerRequest) -> BaseResponse:
-    bridge_client.choose_partner(PlayerId(request.playerId), GameId(request.gameId), Card.from_string(request.partner.value))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.choose_partner(PlayerId(request.playerId), GameId(request.gameId), Card.from_string(request.partner.value))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
 @app.post("/game/trick", response_model_exclude_none = True)
 async def trick(request: TrickRequest) -> BaseResponse:
-    bridge_client.trick(PlayerId(request.playerId), GameId(request.gameId), Card.from_string(request.trick.value))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.trick(PlayerId(request.playerId), GameId(request.gameId), Card.from_string(request.trick.value))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
 @app.post("/game/reset", response_model_exclude_none = True)
 async def reset_game(request: ResetRequest) -> BaseResponse:
-    bridge_client.reset_game(PlayerId(request.playerId), GameId(request.gameId))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    game = await get_backend().bridge_client.reset_game(PlayerId(request.playerId), GameId(request.gameId))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
     return SuccessResponse()
 
+@app.post("/game/actions", response_model_exclude_none = True)
+async def apply_actions(request: ActionsRequest) -> BaseResponse[GameActionsResponse]:
+    actions = [game_action(action, PlayerId(action.playerId or request.playerId)) for action in request.actions]
+    try:
+        game = await get_backend().bridge_client.apply_actions(GameId(request.gameId), actions)
+    except GameActionFailedException as e:
+        not_applied = GameActionNotAppliedException()
+        results = [GameActionResultResponse(index = index, code = not_applied.code, msg = not_applied.msg) for index in range(e.index)]
+        results.append(GameActionResultResponse(index = e.index, code = e.code, msg = e.msg))
+        return BaseResponse(code = e.code, msg = e.msg, data = GameActionsResponse(version = None, results = results))
+    await get_backend().game_socket_manager.broadcast_game_snapshot(game)
+    results = [GameActionResultResponse(index = index, code = 0, msg = "success") for index in range(len(actions))]
+    return SuccessResponse(data = GameActionsResponse(version = game.version, results = results))
+
+def game_action(request: GameActionRequest, player_id: PlayerId) -> Callable[[VersionedGame], None]:
+    if request.action == PlayerAction.BID:
+        bid: Bid | None = get_bid_request_builder().convert(request.bid)
+        return lambda game: game.bid(PlayerBid(player_id = player_id, bid = bid))
+    if request.action == PlayerAction.CHOOSE_PARTNER:
+        partner = Card.from_string(request.partner.value)
+        return lambda game: game.choose_partner(player_id, partner)
+    if request.action == PlayerAction.TRICK:
+        trick = Card.from_string(request.trick.value)
+        return lambda game: game.trick(PlayerTrick(player_id = player_id, trick = trick))
+    return lambda game: game.reset(player_id)
+
 @app.post("/game/delete", response_model_exclude_none = True)
 async def delete_game(request: DeleteRequest) -> BaseResponse:
-    bridge_client.delete_game(GameId(request.gameId))
-    await game_socket_manager.broadcast_game_snapshot(request.gameId)
+    await get_backend().bridge_client.delete_game(GameId(request.gameId))
+    return SuccessResponse()
+
+@app.post("/game/view/batch", response_model = BaseResponse[list[GameViewBatchItemResponse]], response_model_exclude_none = False)
+async def view_games(request: ViewBatchRequest) -> Response:
+    games = await get_backend().bridge_client.find_games([GameId(game_request.gameId) for game_request in request.games])
+    items: list[str] = []
+    for game_request, game in zip(request.games, games):
+        error: BizException | None = None
+        if game is None:
+            error = BridgeGameNotFoundException()
+        elif PlayerId(game_request.playerId) not in game.player_ids:
+            error = GamePlayerNotFound()
+        head = orjson.dumps({"gameId": game_request.gameId, "playerId": game_request.playerId}).decode()[:-1]
+        if error is not None:
+            items.append(f'{head},"code":{error.code},"msg":{orjson.dumps(error.msg).decode()},"data":null}}')
+            continue
+        snapshot: str = get_game_snapshot_serializer().serialize(game, PlayerId(game_request.playerId))
+        items.append(f'{head},"code":0,"msg":"success","data":{snapshot}}}')
+    return Response(content = f'{{"code":0,"msg":"success","data":[{",".join(items)}]}}', media_type = "application/json")
+
+@app.post("/game/delete/batch", response_model_exclude_none = True)
+async def delete_games(request: DeleteBatchRequest) -> BaseResponse:
+    await get_backend().bridge_client.delete_games([GameId(game_id) for game_id in request.gameIds])
     return SuccessResponse()
 
+@app.post("/game/list", response_model_exclude_none = False)
+async def list_games(request: ListRequest) -> BaseResponse[GameListResponse]:
+    statuses = set(request.statuses) if request.statuses else {status for status in GameStatus if status != GameStatus.FINISHED}
+    games, next_after = await get_backend().bridge_client.list_games(
+        None if request.cursor is None else GameId(request.cursor), request.limit, statuses,
+    )
+    return SuccessResponse(data = GameListResponse(
+        games = [
+            GameSummaryResponse(
+                game_id = game.id.value,
+                status = game.status(),
+                player_ids = [player_id.value for player_id in game.player_ids],
+                version = game.version,
+            ) for game in games
+        ],
+        next_cursor = None if next_after is None else next_after.value,
+    ))
+
+@app.get("/health/live", include_in_schema = False)
+async def live() -> BaseResponse[HealthResponse]:
+    backend = get_backend()
+    return SuccessResponse(data = HealthResponse(ready = backend.ready, warm_up_seconds = backend.warm_up_seconds))
+
+@app.get("/health/ready", include_in_schema = False)
+async def ready() -> JSONResponse:
+    backend = get_backend()
+    if not await backend.check_ready():
+        error = BackendNotReadyException()
+        return JSONResponse(status_code = 503, content = {"code": error.code, "msg": error.msg})
+    health = HealthResponse(ready = backend.ready, warm_up_seconds = backend.warm_up_seconds)
+    return JSONResponse(content = SuccessResponse(data = health).model_dump(by_alias = True))
+
+@app.get("/metrics", include_in_schema = False)
+async def metrics() -> Response:
+    return PlainTextResponse(get_metrics().render(), media_type = get_metrics().CONTENT_TYPE)
+
 @app.exception_handler(BizException)
 async def biz_exception_handler(request: Request, exc: BizException) -> JSONResponse:
     return JSONResponse(content = {"code": exc.code, "msg": exc.msg})
@@ -96,9 +223,41 @@ async def request_validation_exception_handler(request: Request, exc: RequestVal
     error_msg = exc.errors()[0]["msg"]
     return JSONResponse(content = {"code": 10000, "msg": error_msg})
 
+async def send_game_snapshot(connection: GameWebSocketConnection):
+    try:
+        game = await get_backend().bridge_client.find_game(GameId(connection.game_id))
+    except BizException:
+        return
+    await get_backend().game_socket_manager.send_game_snapshot(connection, game)
+
+async def send_spectator_snapshot(connection: GameSpectatorConnection):
+    try:
+        game = await get_backend().bridge_client.find_game(GameId(connection.game_id))
+    except BizException:
+        return
+    await get_backend().game_socket_manager.send_spectator_snapshot(connection, game)
+
+@app.websocket("/ws/{game_id}")
+async def spectator_websocket_endpoint(websocket: WebSocket, game_id: str):
+    connection = await get_backend().game_socket_manager.connect_spectator(websocket, game_id)
+    try:
+        await send_spectator_snapshot(connection)
+        while True:
+            text = await websocket.receive_text()
+            try:
+                msg = Message.model_validate_json(text)
+            except Exception:
+                continue
+            if msg.message_type == MessageType.RESYNC:
+                await send_spectator_snapshot(connection)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        get_backend().game_socket_manager.disconnect_spectator(connection)
+
 @app.websocket("/ws/{game_id}/{player_id}")
 async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str):
-    await game_socket_manager.connect(websocket)
+    connection = await get_backend().game_socket_manager.connect(websocket, game_id, player_id)
     last_pong_time = asyncio.get_event_loop().time()
     ping_task = None
 
@@ -107,7 +266,7 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
         try:
             while True:
                 await asyncio.sleep(get_settings().websocket_ping_interval)
-                await game_socket_manager.send_personal_ping(websocket)
+                await get_backend().game_socket_manager.send_personal_ping(connection)
                 if asyncio.get_event_loop().time() - last_pong_time > get_settings().websocket_ping_interval * 2:
                     await websocket.close()
                     break
@@ -116,7 +275,8 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
 
     try:
         ping_task = asyncio.create_task(send_ping())
-        await game_socket_manager.broadcast_message(f"{player_id} joins the chat", game_id)
+        await send_game_snapshot(connection)
+        await get_backend().game_socket_manager.broadcast_message(f"{player_id} joins the chat", game_id)
         while True:
             text = await websocket.receive_text()
             try:
@@ -124,12 +284,16 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
             except Exception:
                 continue
             if msg.message_type == MessageType.CHAT:
-                await game_socket_manager.broadcast_message(f"{player_id}: {msg.message}", game_id)
+                await get_backend().game_socket_manager.broadcast_message(f"{player_id}: {msg.message}", game_id)
             if msg.message_type == MessageType.PONG:
                 last_pong_time = asyncio.get_event_loop().time()
+            if msg.message_type == MessageType.RESYNC:
+                await send_game_snapshot(connection)
+    except WebSocketDisconnect:
+        pass
     finally:
-        game_socket_manager.disconnect(websocket)
-        await game_socket_manager.broadcast_message(f"{player_id} left the chat", game_id)
+        get_backend().game_socket_manager.disconnect(connection)
+        await get_backend().game_socket_manager.broadcast_message(f"{player_id} left the chat", game_id)
         if ping_task is not None:
             ping_task.cancel()
             try:
@@ -1,14 +1,22 @@
 from enum import Enum
+from typing import Any
 
 from app.model import SnakeCaseModel
+from app.response import GamePlayerSnapshotResponse
 
 
 class MessageType(Enum):
     CHAT = "CHAT"
     GAME = "GAME"
+    GAME_PATCH = "GAME_PATCH"
+    RESYNC = "RESYNC"
     PING = "PING"
     PONG = "PONG"
 
 class Message(SnakeCaseModel):
     message_type: MessageType
     message: str | None = None
+    version: int | None = None
+    base_version: int | None = None
+    snapshot: GamePlayerSnapshotResponse | None = None
+    patch: list[dict[str, Any]] | None = None
@@ -0,0 +1,200 @@
+from bisect import bisect_left
+from functools import lru_cache
+import time
+from typing import Callable, Iterable
+
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[str, ...]
+
+class Metric:
+    """
+    A metric family in the Prometheus text exposition format. Samples are keyed by the tuple of
+    label values so recording is a dict lookup and no lock is needed on the event loop thread.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        yield from self.samples()
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+    def format_labels(self, labels: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{self.__escape(value)}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def __escape(self, value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter(Metric):
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, label_names)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{self.format_labels(labels)} {value}"
+
+class Histogram(Metric):
+
+    type_name = "histogram"
+
+    def __init__(
+        self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        # per labels: non cumulative count per bucket (the last one is +Inf), then the sum
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        sample = self.values.get(labels)
+        if sample is None:
+            sample = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        sample[0][bisect_left(self.buckets, value)] += 1
+        sample[1][0] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for le, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                bucket_labels = self.format_labels(labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{self.format_labels(labels)} {total[0]}"
+            yield f"{self.name}_count{self.format_labels(labels)} {cumulative}"
+
+class CallbackGauge(Metric):
+    """
+    Gauge read from live state at scrape time, so the hot path records nothing.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self, name: str, help: str, label_names: tuple[str, ...] = (), callback: Callable[[], Iterable[tuple[Labels, float]]] | None = None,
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        if self.callback is None:
+            return
+        for labels, value in self.callback():
+            yield f"{self.name}{self.format_labels(labels)} {value}"
+
+class Metrics:
+    """
+    The service's metrics, exposed on `GET /metrics`.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self) -> None:
+        self.http_request_duration = Histogram(
+            "bridge_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"),
+        )
+        self.datastore_operation_duration = Histogram(
+            "bridge_datastore_operation_duration_seconds", "Datastore call latency.", ("datastore", "operation"),
+        )
+        self.datastore_errors = Counter(
+            "bridge_datastore_errors_total", "Datastore calls failed, by BizException code.", ("datastore", "operation", "code"),
+        )
+        self.single_flight_queries = Counter(
+            "bridge_single_flight_queries_total",
+            "Game reads by whether they started a backend query (leader) or joined one in flight (shared).",
+            ("result",),
+        )
+        self.broadcast_fanout_duration = Histogram(
+            "bridge_broadcast_fanout_duration_seconds", "Time to fan a broadcast out to this worker's WebSockets.", ("message_type",),
+        )
+        self.broadcast_game_messages = Counter(
+            "bridge_broadcast_game_messages_total",
+            "Seat game messages sent, by whether they were built for the socket (built) or reused from another socket of the seat (reused).",
+            ("result",),
+        )
+        self.websocket_connections = CallbackGauge(
+            "bridge_websocket_connections", "Open WebSockets on this worker by game.", ("game_id",),
+        )
+        self.websocket_send_queue_depth = CallbackGauge(
+            "bridge_websocket_send_queue_depth", "Messages waiting in WebSocket send queues on this worker by game.", ("game_id",),
+        )
+        self.websocket_spectators = CallbackGauge(
+            "bridge_websocket_spectators", "Open spectator WebSockets on this worker by game.", ("game_id",),
+        )
+        self.games_reaped = Counter(
+            "bridge_games_reaped_total", "Games deleted by the reaper, by reason (finished or idle).", ("reason",),
+        )
+        self.game_reaper_sweep_duration = Histogram(
+            "bridge_game_reaper_sweep_duration_seconds", "Time of one reaper sweep, including the deletes.",
+        )
+        self.metrics: list[Metric] = [
+            self.http_request_duration,
+            self.datastore_operation_duration,
+            self.datastore_errors,
+            self.single_flight_queries,
+            self.broadcast_fanout_duration,
+            self.broadcast_game_messages,
+            self.websocket_connections,
+            self.websocket_send_queue_depth,
+            self.websocket_spectators,
+            self.games_reaped,
+            self.game_reaper_sweep_duration,
+        ]
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request, labelled with the matched route template
+    rather than the raw path so ids in paths do not blow up the label set.
+    """
+
+    def __init__(self, app, metrics: Metrics | None = None) -> None:
+        self.app = app
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            self.metrics.http_request_duration.observe(
+                time.perf_counter() - start,
+                (scope["method"], route.path if route is not None else "unmatched", str(status)),
+            )
+
+@lru_cache
+def get_metrics() -> Metrics:
+    return Metrics()
@@ -8,6 +8,8 @@ class SnakeCaseModel(BaseModel):
         alias_generator = to_camel,
         populate_by_name = True,
         from_attributes = True,
+        # schemas are built on first use, or by the backend warm up, instead of at import
+        defer_build = True,
     )
 
 class BidEnum(Enum):
@@ -0,0 +1,98 @@
+from abc import ABC, abstractmethod
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str], Awaitable[None]]
+
+class PubSub(ABC):
+    """
+    Backplane carrying game events and chat between workers, so every worker can fan out
+    to the WebSockets it holds.
+    """
+
+    def __init__(self) -> None:
+        self.handlers: dict[str, Handler] = {}
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        self.handlers[channel] = handler
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str) -> None:
+        pass
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def dispatch(self, channel: str, message: str) -> None:
+        handler = self.handlers.get(channel)
+        if handler is None:
+            return
+        try:
+            await handler(message)
+        except Exception as e:
+            logger.error(f"pubsub handler for channel {channel} failed: {e!r}")
+
+class LocalPubSub(PubSub):
+    """
+    In-process backplane, for a single worker.
+    """
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self.dispatch(channel, message)
+
+class RedisPubSub(PubSub):
+    """
+    Backplane on Redis (or any Redis protocol compatible broker) PUBLISH/SUBSCRIBE.
+    """
+
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        import redis.asyncio as redis
+        self.client = redis.from_url(url, decode_responses = True)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages = True)
+        self.listen_task: asyncio.Task | None = None
+
+    async def publish(self, channel: str, message: str) -> None:
+        # callers publish after the change is saved, an unreachable broker must not fail them
+        try:
+            await self.client.publish(channel, message)
+        except Exception as e:
+            logger.error(f"redis publish to channel {channel} failed: {e!r}")
+
+    async def start(self) -> None:
+        if len(self.handlers) == 0 or self.listen_task is not None:
+            return
+        await self.pubsub.subscribe(*self.handlers.keys())
+        self.listen_task = asyncio.create_task(self.__listen())
+
+    async def close(self) -> None:
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+            try:
+                await self.listen_task
+            except asyncio.CancelledError:
+                pass
+            self.listen_task = None
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def __listen(self) -> None:
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages = True, timeout = 1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"redis pubsub receive failed: {e!r}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            await self.dispatch(message["channel"], message["data"])
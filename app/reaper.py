@@ -0,0 +1,137 @@
+import asyncio
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+import logging
+import time
+
+from app.bridge import AsyncBridgeClient
+from app.datastore import GameSQLiteDatastore
+from app.game import GameStatus
+from app.metrics import Metrics, get_metrics
+from app.websocket import GameWebSocketManager
+
+
+logger = logging.getLogger(__name__)
+
+class GameReaper:
+    """
+    Background sweep deleting games `finished_ttl` seconds after they finished and games without a
+    move for `idle_ttl` seconds, in bulk, and closing their WebSockets. A TTL of `None` keeps those
+    games forever.
+
+    With SQLite the `status`/`updated_at` index is queried. Other datastores are paged through every
+    `interval` seconds, remembering when each game's version last changed, so ages count from when
+    this worker first saw the current version and restart with the worker.
+    """
+
+    def __init__(
+        self,
+        bridge_client: AsyncBridgeClient,
+        socket_manager: GameWebSocketManager,
+        finished_ttl: float | None = None,
+        idle_ttl: float | None = None,
+        interval: float = 300.0,
+        page_size: int = 100,
+        index: GameSQLiteDatastore | None = None,
+        metrics: Metrics | None = None,
+    ) -> None:
+        self.bridge_client = bridge_client
+        self.socket_manager = socket_manager
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.page_size = page_size
+        self.index = index
+        self.metrics = metrics if metrics is not None else get_metrics()
+        # game id -> (version, monotonic time the version was first seen)
+        self.seen: dict[str, tuple[int, float]] = {}
+        self.sweep_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.finished_ttl is None and self.idle_ttl is None:
+            return
+        if self.sweep_task is None:
+            self.sweep_task = asyncio.create_task(self.__sweep_loop())
+
+    async def close(self) -> None:
+        if self.sweep_task is None:
+            return
+        self.sweep_task.cancel()
+        try:
+            await self.sweep_task
+        except asyncio.CancelledError:
+            pass
+        self.sweep_task = None
+
+    async def sweep(self) -> int:
+        """
+        Deletes the expired games and returns how many were deleted.
+        """
+        start = time.perf_counter()
+        reaped = 0
+        while True:
+            expired, more = await (self.__expired_by_index() if self.index is not None else self.__expired_by_scan())
+            if len(expired) > 0:
+                # a scan can take long, a game moved since it was seen is kept
+                versions = None if self.index is not None else {game_id: self.seen[game_id][0] for game_id in expired}
+                deleted = [
+                    game_id.value for game_id in await self.bridge_client.delete_games([GameId(game_id) for game_id in expired], versions)
+                ]
+                if len(deleted) > 0:
+                    await self.socket_manager.close_games(deleted)
+                for game_id in deleted:
+                    self.seen.pop(game_id, None)
+                    self.metrics.games_reaped.inc((expired[game_id],))
+                reaped += len(deleted)
+            if not more:
+                break
+        if reaped > 0:
+            logger.info(f"reaped {reaped} games")
+        self.metrics.game_reaper_sweep_duration.observe(time.perf_counter() - start)
+        return reaped
+
+    async def __sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except BizException as e:
+                logger.error(f"game reaper sweep failed: {e.msg}")
+
+    async def __expired_by_index(self) -> tuple[dict[str, str], bool]:
+        now = time.time()
+        expired: dict[str, str] = {}
+        more = False
+        for status in GameStatus:
+            ttl, reason = self.__ttl(status)
+            if ttl is None:
+                continue
+            game_ids = await self.index.query_ids_by_status(status, now - ttl, self.page_size)
+            expired.update({game_id.value: reason for game_id in game_ids})
+            # a full page may have more behind it, read again once this one is deleted
+            more = more or len(game_ids) == self.page_size
+        return expired, more
+
+    async def __expired_by_scan(self) -> tuple[dict[str, str], bool]:
+        now = time.monotonic()
+        seen: dict[str, tuple[int, float]] = {}
+        expired: dict[str, str] = {}
+        after: GameId | None = None
+        while True:
+            games, after = await self.bridge_client.list_games(after, self.page_size, set(GameStatus))
+            for game in games:
+                version, since = self.seen.get(game.id.value, (None, now))
+                seen[game.id.value] = (game.version, since if version == game.version else now)
+                ttl, reason = self.__ttl(game.status())
+                if ttl is not None and now - seen[game.id.value][1] >= ttl:
+                    expired[game.id.value] = reason
+            if after is None:
+                break
+        # games deleted since the last sweep are dropped here
+        self.seen = seen
+        return expired, False
+
+    def __ttl(self, status: GameStatus) -> tuple[float | None, str]:
+        if status == GameStatus.FINISHED:
+            return self.finished_ttl, "finished"
+        return self.idle_ttl, "idle"
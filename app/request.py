@@ -1,13 +1,24 @@
-from pydantic import BaseModel
+from bridgepy.player import PlayerAction
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field, model_validator
+from typing import Annotated
 
+from app.game import GameStatus
 from app.model import BidEnum, CardEnum
 
 
+def check_game_id(game_id: str) -> str:
+    # AppSheet selectors cannot quote a double quote, see AppSheetClient.text
+    if '"' in game_id:
+        raise ValueError("game id must not contain a double quote")
+    return game_id
+
+GameIdField = Annotated[str, AfterValidator(check_game_id)]
+
 class BaseRequest(BaseModel):
-    pass
+    model_config = ConfigDict(defer_build = True)
 
 class GameRequest(BaseRequest):
-    gameId: str
+    gameId: GameIdField
     playerId: str
 
 class CreateRequest(GameRequest):
@@ -17,7 +28,8 @@ class JoinRequest(GameRequest):
     pass
 
 class ViewRequest(GameRequest):
-    pass
+    sinceVersion: int | None = None
+    waitSeconds: float | None = None
 
 class BidRequest(GameRequest):
     bid: BidEnum
@@ -32,4 +44,32 @@ class ResetRequest(GameRequest):
     pass
 
 class DeleteRequest(BaseRequest):
-    gameId: str
+    gameId: GameIdField
+
+class ViewBatchRequest(BaseRequest):
+    games: list[GameRequest] = Field(min_length = 1, max_length = 500)
+
+class DeleteBatchRequest(BaseRequest):
+    gameIds: list[GameIdField] = Field(min_length = 1, max_length = 500)
+
+class ListRequest(BaseRequest):
+    cursor: GameIdField | None = None
+    limit: int = Field(default = 50, ge = 1, le = 500)
+    statuses: list[GameStatus] | None = None
+
+class GameActionRequest(BaseRequest):
+    action: PlayerAction
+    playerId: str | None = None
+    bid: BidEnum | None = None
+    partner: CardEnum | None = None
+    trick: CardEnum | None = None
+
+    @model_validator(mode = "after")
+    def check_argument(self) -> "GameActionRequest":
+        argument = {PlayerAction.BID: "bid", PlayerAction.CHOOSE_PARTNER: "partner", PlayerAction.TRICK: "trick"}.get(self.action)
+        if argument is not None and getattr(self, argument) is None:
+            raise ValueError(f"{argument} is required for a {self.action.value} action")
+        return self
+
+class ActionsRequest(GameRequest):
+    actions: list[GameActionRequest] = Field(min_length = 1, max_length = 100)
@@ -0,0 +1,50 @@
+import logging
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Consecutive failure counting circuit breaker.
+
+    Closed: calls go through. After `failure_threshold` failures in a row it opens and calls fail
+    fast, except for one probe call let through every `reset_timeout` seconds (half open). A success
+    closes the circuit and a failure keeps it open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        # the probe: restart the window so concurrent callers keep failing fast until it returns
+        self.opened_at = now
+        return True
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"{self.name} circuit closed")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.failure_threshold:
+            logger.warning(f"{self.name} circuit opened after {self.failures} failures in a row")
+            self.opened_at = time.monotonic()
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Exponential backoff with full jitter for the retry after `attempt` (0 based) failed.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
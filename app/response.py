@@ -2,6 +2,7 @@ from bridgepy.card import Suit
 from bridgepy.player import PlayerAction
 from typing import Generic, TypeVar
 
+from app.game import GameStatus
 from app.model import CardEnum, GameTrick, PlayerBid, PlayerScore, SnakeCaseModel
 
 
@@ -31,3 +32,39 @@ class GamePlayerSnapshotResponse(SnakeCaseModel):
     tricks: list[GameTrick]
     scores: list[PlayerScore]
     player_turn: str | None
+    version: int = 0
+
+class NotModifiedResponse(BaseResponse, Generic[T]):
+    code: int = 0
+    msg: str = "not modified"
+    data: T | None = None
+
+class GameSummaryResponse(SnakeCaseModel):
+    game_id: str
+    status: GameStatus
+    player_ids: list[str]
+    version: int
+
+class GameListResponse(SnakeCaseModel):
+    games: list[GameSummaryResponse]
+    next_cursor: str | None
+
+class GameViewBatchItemResponse(SnakeCaseModel):
+    game_id: str
+    player_id: str
+    code: int
+    msg: str
+    data: GamePlayerSnapshotResponse | None = None
+
+class GameActionResultResponse(SnakeCaseModel):
+    index: int
+    code: int
+    msg: str
+
+class GameActionsResponse(SnakeCaseModel):
+    version: int | None
+    results: list[GameActionResultResponse]
+
+class HealthResponse(SnakeCaseModel):
+    ready: bool
+    warm_up_seconds: float | None
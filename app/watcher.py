@@ -0,0 +1,28 @@
+import asyncio
+
+
+class GameVersionWatcher:
+    """
+    Lets long-poll requests wait for a game to change without polling the datastore.
+    """
+
+    def __init__(self) -> None:
+        self.events: dict[str, asyncio.Event] = {}
+
+    def notify(self, game_id: str) -> None:
+        event = self.events.pop(game_id, None)
+        if event is not None:
+            event.set()
+
+    def watch(self, game_id: str) -> asyncio.Event:
+        """
+        The event set by the game's next `notify`. Taken before the game is read, a change saved while the read is in flight is not missed.
+        """
+        return self.events.setdefault(game_id, asyncio.Event())
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
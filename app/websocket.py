@@ -1,67 +1,380 @@
-from bridgepy.bridge import BridgeClient
-from bridgepy.game import Game, GameId, GamePlayerSnapshot
+import asyncio
 from bridgepy.player import PlayerId
 from fastapi import WebSocket
 import logging
+import orjson
+import time
+from typing import Any, Iterable
 
-from app.dataconverter import get_game_snapshot_response_assembler
+from app.codec import GameCodec, get_game_codec
+from app.dataconverter import get_game_snapshot_patch_builder, get_game_snapshot_serializer
+from app.game import VersionedGame
 from app.message import Message, MessageType
+from app.metrics import Labels, Metrics, get_metrics
+from app.pubsub import LocalPubSub, PubSub
+from app.watcher import GameVersionWatcher
 
 
-logging.basicConfig(
-    level = logging.INFO,
-    format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
-
 logger = logging.getLogger(__name__)
 
+class GameWebSocketConnection:
+    """
+    A player's WebSocket with a bounded send queue drained by its own sender task,
+    so a slow or dead client never blocks a broadcast to the rest of the table.
+    """
+
+    def __init__(self, websocket: WebSocket, game_id: str, player_id: str, send_queue_size: int, send_timeout: float):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.player_id = player_id
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize = send_queue_size)
+        self.send_task: asyncio.Task | None = None
+        self.closed = False
+        self.snapshot: dict[str, Any] | None = None
+        self.snapshot_instance: str | None = None
+        self.snapshot_version: int | None = None
+
+    def start(self, on_failure) -> None:
+        self.send_task = asyncio.create_task(self.__send_loop(on_failure))
+
+    def send(self, msg: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def evict(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.send_task is not None:
+            self.send_task.cancel()
+        self.send_task = asyncio.create_task(self.__close())
+
+    async def __send_loop(self, on_failure) -> None:
+        while True:
+            msg = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(msg), self.send_timeout)
+            except Exception as e:
+                logger.warning(f"websocket send failed game_id = {self.game_id}, player_id = {self.player_id}: {e!r}")
+                on_failure(self)
+                return
+
+    async def __close(self) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
+class GameSpectatorConnection:
+    """
+    A spectator's WebSocket. Only the latest game view is kept: one not sent yet is replaced by a
+    newer one, so a slow spectator skips intermediate states instead of queueing them.
+    """
+
+    def __init__(self, websocket: WebSocket, game_id: str, send_timeout: float):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.send_timeout = send_timeout
+        self.latest: str | None = None
+        # newest version of the game instance handed to send, older ones arriving late are ignored
+        self.instance: str | None = None
+        self.version: int | None = None
+        self.pending = asyncio.Event()
+        self.send_task: asyncio.Task | None = None
+        self.closed = False
+        self.dropped = 0
+
+    def start(self, on_failure) -> None:
+        self.send_task = asyncio.create_task(self.__send_loop(on_failure))
+
+    def send(self, instance: str, version: int, msg: str) -> None:
+        if self.closed or (instance == self.instance and self.version is not None and version <= self.version):
+            return
+        if self.latest is not None:
+            self.dropped += 1
+        self.latest = msg
+        self.instance = instance
+        self.version = version
+        self.pending.set()
+
+    def evict(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.send_task is not None:
+            self.send_task.cancel()
+        self.send_task = asyncio.create_task(self.__close())
+
+    async def __send_loop(self, on_failure) -> None:
+        while True:
+            await self.pending.wait()
+            self.pending.clear()
+            msg, self.latest = self.latest, None
+            if msg is None:
+                continue
+            try:
+                await asyncio.wait_for(self.websocket.send_text(msg), self.send_timeout)
+            except Exception as e:
+                logger.warning(f"spectator websocket send failed game_id = {self.game_id}: {e!r}")
+                on_failure(self)
+                return
+
+    async def __close(self) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(), self.send_timeout)
+        except Exception:
+            pass
+
 class GameWebSocketManager:
+    """
+    Broadcasts go through the pubsub backplane and every worker fans them out to the sockets it holds.
+    """
 
-    def __init__(self, bridge_client: BridgeClient):
-        self.bridge_client = bridge_client
-        self.active_connections: list[WebSocket] = []
+    GAME_CHANNEL = "bridge:game"
+    CHAT_CHANNEL = "bridge:chat"
+    CLOSE_CHANNEL = "bridge:close"
+    RESYNC_CHANNEL = "bridge:resync"
 
-    async def connect(self, websocket: WebSocket):
-        path_params = websocket.scope.get("path_params")
-        logger.info(f"websocket.scope.path_params = {path_params}")
+    def __init__(
+        self,
+        pubsub: PubSub | None = None,
+        codec: GameCodec | None = None,
+        game_watcher: GameVersionWatcher | None = None,
+        send_queue_size: int = 32,
+        send_timeout: float = 5.0,
+        spectator_delay: float = 0.0,
+        metrics: Metrics | None = None,
+    ):
+        self.pubsub: PubSub = pubsub if pubsub is not None else LocalPubSub()
+        self.codec: GameCodec = codec if codec is not None else get_game_codec("compact")
+        self.game_watcher = game_watcher
+        self.send_queue_size = send_queue_size
+        self.send_timeout = send_timeout
+        self.spectator_delay = spectator_delay
+        # game id -> player id -> the seat's sockets, e.g. one per open tab
+        self.active_connections: dict[str, dict[str, set[GameWebSocketConnection]]] = {}
+        self.spectators: dict[str, set[GameSpectatorConnection]] = {}
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.metrics.websocket_connections.callback = self.__connection_counts
+        self.metrics.websocket_send_queue_depth.callback = self.__send_queue_depths
+        self.metrics.websocket_spectators.callback = self.__spectator_counts
+        self.pubsub.subscribe(self.GAME_CHANNEL, self.__on_game)
+        self.pubsub.subscribe(self.CHAT_CHANNEL, self.__on_chat)
+        self.pubsub.subscribe(self.CLOSE_CHANNEL, self.__on_close)
+        self.pubsub.subscribe(self.RESYNC_CHANNEL, self.__on_resync)
+
+    async def connect(self, websocket: WebSocket, game_id: str, player_id: str) -> GameWebSocketConnection:
+        logger.info(f"websocket connect game_id = {game_id}, player_id = {player_id}")
+        await websocket.accept()
+        connection = GameWebSocketConnection(websocket, game_id, player_id, self.send_queue_size, self.send_timeout)
+        connection.start(self.disconnect)
+        self.active_connections.setdefault(game_id, {}).setdefault(player_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, connection: GameWebSocketConnection):
+        connection.evict()
+        game_connections = self.active_connections.get(connection.game_id)
+        seat_connections = None if game_connections is None else game_connections.get(connection.player_id)
+        if seat_connections is None or connection not in seat_connections:
+            return
+        seat_connections.discard(connection)
+        if len(seat_connections) == 0:
+            del game_connections[connection.player_id]
+        if len(game_connections) == 0:
+            del self.active_connections[connection.game_id]
+
+    async def connect_spectator(self, websocket: WebSocket, game_id: str) -> GameSpectatorConnection:
+        logger.info(f"spectator websocket connect game_id = {game_id}")
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = GameSpectatorConnection(websocket, game_id, self.send_timeout)
+        connection.start(self.disconnect_spectator)
+        self.spectators.setdefault(game_id, set()).add(connection)
+        return connection
+
+    def disconnect_spectator(self, connection: GameSpectatorConnection):
+        connection.evict()
+        game_spectators = self.spectators.get(connection.game_id)
+        if game_spectators is None or connection not in game_spectators:
+            return
+        game_spectators.discard(connection)
+        if len(game_spectators) == 0:
+            del self.spectators[connection.game_id]
+        if connection.dropped > 0:
+            logger.info(f"spectator websocket game_id = {connection.game_id} skipped {connection.dropped} stale game views")
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    async def send_spectator_snapshot(self, connection: GameSpectatorConnection, game: VersionedGame):
+        # sent even when the spectator already has this version, e.g. on resync
+        connection.version = None
+        self.__send_spectators([connection], game, self.__spectator_message(game))
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        msg: str = Message(message_type = MessageType.CHAT, message = message).model_dump_json(by_alias = True)
-        await websocket.send_text(msg)
+    async def send_personal_message(self, message: str, connection: GameWebSocketConnection):
+        msg: str = Message(message_type = MessageType.CHAT, message = message).model_dump_json(by_alias = True, exclude_none = True)
+        self.__send(connection, msg)
     
-    async def send_personal_ping(self, websocket: WebSocket):
+    async def send_personal_ping(self, connection: GameWebSocketConnection):
         msg: str = Message(message_type = MessageType.PING).model_dump_json(by_alias = True, exclude_none = True)
-        await websocket.send_text(msg)
+        self.__send(connection, msg)
+
+    async def send_game_snapshot(self, connection: GameWebSocketConnection, game: VersionedGame):
+        if PlayerId(connection.player_id) not in game.player_ids:
+            return
+        self.__send_snapshot(connection, game)
 
     async def broadcast_message(self, message: str, game_id: str):
-        for connection in self.active_connections:
-            path_params = connection.scope.get("path_params")
-            if path_params is None:
-                logger.error(f"path_params not found in scope: {connection.scope}")
-                continue
-            if path_params.get("game_id") != game_id:
-                continue
-            msg: str = Message(message_type = MessageType.CHAT, message = message).model_dump_json(by_alias = True)
-            await connection.send_text(msg)
-    
-    async def broadcast_game_snapshot(self, game_id: str):
-        if len(self.active_connections) == 0:
+        await self.pubsub.publish(self.CHAT_CHANNEL, orjson.dumps({"gameId": game_id, "message": message}).decode())
+
+    async def broadcast_game_snapshot(self, game: VersionedGame):
+        await self.pubsub.publish(self.GAME_CHANNEL, self.codec.encode(game))
+
+    async def resync_game(self, game: VersionedGame):
+        """
+        Sends the game in full to every WebSocket of it, on all workers, even to those already at its version:
+        a write lost to a concurrent one leaves clients on a version whose content was never stored.
+        """
+        await self.pubsub.publish(self.RESYNC_CHANNEL, self.codec.encode(game))
+
+    async def close_games(self, game_ids: list[str]):
+        """
+        Closes every WebSocket of the games, on all workers.
+        """
+        await self.pubsub.publish(self.CLOSE_CHANNEL, orjson.dumps(game_ids).decode())
+
+    async def __on_chat(self, data: str):
+        chat = orjson.loads(data)
+        game_id: str = chat["gameId"]
+        message: str = chat["message"]
+        game_connections = self.active_connections.get(game_id)
+        if game_connections is None:
             return
-        game: Game = self.bridge_client.find_game(GameId(game_id))
-        for connection in self.active_connections:
-            path_params = connection.scope.get("path_params")
-            if path_params is None:
-                logger.error(f"path_params not found in scope: {connection.scope}")
+        start = time.perf_counter()
+        msg: str = Message(message_type = MessageType.CHAT, message = message).model_dump_json(by_alias = True, exclude_none = True)
+        for seat_connections in list(game_connections.values()):
+            for connection in list(seat_connections):
+                self.__send(connection, msg)
+        self.metrics.broadcast_fanout_duration.observe(time.perf_counter() - start, (MessageType.CHAT.value,))
+
+    async def __on_game(self, data: str):
+        game: VersionedGame = self.codec.decode(data)
+        if self.game_watcher is not None:
+            self.game_watcher.notify(game.id.value)
+        game_connections = self.active_connections.get(game.id.value)
+        game_spectators = self.spectators.get(game.id.value)
+        if game_connections is None and game_spectators is None:
+            return
+        start = time.perf_counter()
+        if game_spectators is not None:
+            self.__send_spectators(list(game_spectators), game, self.__spectator_message(game))
+        # a seat's messages by base version, shared by every socket of the seat holding that base
+        built = reused = 0
+        for player_id, seat_connections in list((game_connections or {}).items()):
+            if PlayerId(player_id) not in game.player_ids:
                 continue
-            if path_params.get("game_id") != game_id:
+            messages: dict[int | None, str] = {}
+            for connection in list(seat_connections):
+                # a snapshot of a deleted game of the same id is no base, the seat gets a full one
+                same_instance = connection.snapshot_instance == game.instance
+                # a version arriving late over the backplane must not roll the seat back
+                if same_instance and connection.snapshot_version is not None and game.version <= connection.snapshot_version:
+                    continue
+                base_version = connection.snapshot_version if same_instance else None
+                msg = messages.get(base_version)
+                if msg is None:
+                    msg = messages[base_version] = self.__game_message(
+                        game, player_id, connection.snapshot if same_instance else None, base_version,
+                    )
+                    built += 1
+                else:
+                    reused += 1
+                connection.snapshot = get_game_snapshot_serializer().to_dict(game, PlayerId(player_id))
+                connection.snapshot_instance = game.instance
+                connection.snapshot_version = game.version
+                self.__send(connection, msg)
+        self.metrics.broadcast_game_messages.inc(("built",), built)
+        self.metrics.broadcast_game_messages.inc(("reused",), reused)
+        self.metrics.broadcast_fanout_duration.observe(time.perf_counter() - start, (MessageType.GAME.value,))
+
+    async def __on_resync(self, data: str):
+        game: VersionedGame = self.codec.decode(data)
+        get_game_snapshot_serializer().forget(game.id.value)
+        if self.game_watcher is not None:
+            self.game_watcher.notify(game.id.value)
+        for player_id, seat_connections in list(self.active_connections.get(game.id.value, {}).items()):
+            if PlayerId(player_id) not in game.player_ids:
                 continue
-            player_id = path_params.get("player_id")
-            game_snapshot: GamePlayerSnapshot = game.player_snapshot(PlayerId(player_id))
-            message: str = get_game_snapshot_response_assembler().convert(game_snapshot).model_dump_json(by_alias = True)
-            msg: str = Message(message_type = MessageType.GAME, message = message).model_dump_json(by_alias = True)
-            await connection.send_text(msg)
+            for connection in list(seat_connections):
+                self.__send_snapshot(connection, game)
+        for spectator in list(self.spectators.get(game.id.value, set())):
+            await self.send_spectator_snapshot(spectator, game)
+
+    async def __on_close(self, data: str):
+        game_ids: list[str] = orjson.loads(data)
+        for game_id in game_ids:
+            for seat_connections in list(self.active_connections.get(game_id, {}).values()):
+                for connection in list(seat_connections):
+                    logger.info(f"websocket close game_id = {game_id}, player_id = {connection.player_id}")
+                    self.disconnect(connection)
+            for spectator in list(self.spectators.get(game_id, set())):
+                self.disconnect_spectator(spectator)
+
+    def __send_snapshot(self, connection: GameWebSocketConnection, game: VersionedGame):
+        msg = self.__game_message(game, connection.player_id, None, None)
+        connection.snapshot = get_game_snapshot_serializer().to_dict(game, PlayerId(connection.player_id))
+        connection.snapshot_instance = game.instance
+        connection.snapshot_version = game.version
+        self.__send(connection, msg)
+
+    def __game_message(self, game: VersionedGame, player_id: str, base: dict[str, Any] | None, base_version: int | None) -> str:
+        """
+        The seat's full snapshot, or its patch against `base` when the connection already has one.
+        Both are built straight from the memoized snapshot JSON/dict, without going through `Message`.
+        """
+        if base is None:
+            snapshot: str = get_game_snapshot_serializer().serialize(game, PlayerId(player_id))
+            return f'{{"messageType":"{MessageType.GAME.value}","version":{game.version},"snapshot":{snapshot}}}'
+        patch = get_game_snapshot_patch_builder().convert((base, get_game_snapshot_serializer().to_dict(game, PlayerId(player_id))))
+        return orjson.dumps({
+            "messageType": MessageType.GAME_PATCH.value, "version": game.version, "baseVersion": base_version, "patch": patch,
+        }).decode()
+
+    def __spectator_message(self, game: VersionedGame) -> str:
+        snapshot: str = get_game_snapshot_serializer().serialize_spectator(game)
+        return f'{{"messageType":"{MessageType.GAME.value}","version":{game.version},"snapshot":{snapshot}}}'
+
+    def __send_spectators(self, spectators: list[GameSpectatorConnection], game: VersionedGame, msg: str):
+        if self.spectator_delay > 0:
+            asyncio.get_running_loop().call_later(
+                self.spectator_delay, self.__deliver_spectators, spectators, game.instance, game.version, msg,
+            )
+            return
+        self.__deliver_spectators(spectators, game.instance, game.version, msg)
+
+    def __deliver_spectators(self, spectators: list[GameSpectatorConnection], instance: str, version: int, msg: str):
+        # one message, encoded once, for every spectator of the game
+        for spectator in spectators:
+            spectator.send(instance, version, msg)
+
+    def __connection_counts(self) -> Iterable[tuple[Labels, float]]:
+        for game_id, game_connections in list(self.active_connections.items()):
+            yield (game_id,), sum(len(seat_connections) for seat_connections in game_connections.values())
+
+    def __spectator_counts(self) -> Iterable[tuple[Labels, float]]:
+        for game_id, game_spectators in list(self.spectators.items()):
+            yield (game_id,), len(game_spectators)
+
+    def __send_queue_depths(self) -> Iterable[tuple[Labels, float]]:
+        for game_id, game_connections in list(self.active_connections.items()):
+            yield (game_id,), sum(
+                connection.queue.qsize() for seat_connections in game_connections.values() for connection in seat_connections
+            )
+
+    def __send(self, connection: GameWebSocketConnection, msg: str):
+        if connection.send(msg):
+            return
+        logger.warning(f"websocket send queue full, evicting game_id = {connection.game_id}, player_id = {connection.player_id}")
+        self.disconnect(connection)
@@ -0,0 +1,80 @@
+"""
+In-memory stand-in for the AppSheet Action API, with injectable latency and faults.
+
+    FAKE_APPSHEET_LATENCY=0.2 FAKE_APPSHEET_JITTER=0.05 uvicorn benchmark.fake_appsheet:app --port 8001
+
+Tables are kept apart. Every call sleeps `latency` seconds plus up to `jitter` seconds (uniform), then applies the
+`Add`/`Edit`/`Delete`/`Find` action to its rows. A `Find` with no rows returns every row in id order, narrowed by the
+parts of its `Selector` the service pages with: an `[id] > "..."` cursor and a `Top(..., n)` limit.
+
+Faults: a `FAKE_APPSHEET_ERROR_RATE` fraction of calls answer 503 without touching the rows, and a
+`FAKE_APPSHEET_HANG_RATE` fraction hang for `FAKE_APPSHEET_HANG_SECONDS` first. Both can be changed
+while running with `POST /faults {"errorRate": 1.0, "hangRate": 0.0}`, e.g. to simulate an outage.
+"""
+import asyncio
+import os
+import random
+import re
+from typing import Any
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+LATENCY = float(os.environ.get("FAKE_APPSHEET_LATENCY", "0"))
+JITTER = float(os.environ.get("FAKE_APPSHEET_JITTER", "0"))
+HANG_SECONDS = float(os.environ.get("FAKE_APPSHEET_HANG_SECONDS", "60"))
+
+ID_CURSOR = re.compile(r'\[id\] > "([^"]*)"')
+TOP = re.compile(r"^Top\(.*, (\d+)\)$")
+
+app = FastAPI()
+tables: dict[str, dict[str, dict[str, Any]]] = {}
+calls: dict[str, int] = {}
+faults: dict[str, float] = {
+    "errorRate": float(os.environ.get("FAKE_APPSHEET_ERROR_RATE", "0")),
+    "hangRate": float(os.environ.get("FAKE_APPSHEET_HANG_RATE", "0")),
+}
+
+@app.post("/apps/{app_id}/tables/{table}/Action")
+async def action(app_id: str, table: str, request: Request) -> Any:
+    data = await request.json()
+    action: str = data["Action"]
+    calls[action] = calls.get(action, 0) + 1
+    if random.random() < faults["hangRate"]:
+        calls["hang"] = calls.get("hang", 0) + 1
+        await asyncio.sleep(HANG_SECONDS)
+    await asyncio.sleep(LATENCY + random.uniform(0, JITTER))
+    if random.random() < faults["errorRate"]:
+        calls["error"] = calls.get("error", 0) + 1
+        return JSONResponse(status_code = 503, content = {"error": "injected fault"})
+    rows = tables.setdefault(table, {})
+    if action in ("Add", "Edit"):
+        for row in data["Rows"]:
+            rows[row["id"]] = row
+        return data["Rows"]
+    if action == "Delete":
+        for row in data["Rows"]:
+            rows.pop(row["id"], None)
+        return []
+    if len(data["Rows"]) == 0:
+        return select(sorted(rows.values(), key = lambda row: row["id"]), data.get("Properties", {}).get("Selector", ""))
+    return [rows[row["id"]] for row in data["Rows"] if row["id"] in rows]
+
+def select(rows: list[dict[str, Any]], selector: str) -> list[dict[str, Any]]:
+    cursor = ID_CURSOR.search(selector)
+    if cursor is not None:
+        rows = [row for row in rows if row["id"] > cursor.group(1)]
+    top = TOP.match(selector)
+    if top is not None:
+        rows = rows[:int(top.group(1))]
+    return rows
+
+@app.get("/calls")
+async def get_calls() -> dict[str, int]:
+    return calls
+
+@app.post("/faults")
+async def set_faults(request: Request) -> dict[str, float]:
+    faults.update({key: float(value) for key, value in (await request.json()).items() if key in faults})
+    return faults
@@ -0,0 +1,371 @@
+"""
+Load test driving concurrent 4-player games through a running copy of the service.
+
+    python -m benchmark.loadtest --games 50
+    python -m benchmark.loadtest --games 50 --datastore appsheet --latency 0.2 --jitter 0.05 --output result.json
+
+The service (and, for `--datastore appsheet`, the fake AppSheet server) is started as a subprocess.
+Every game runs create -> 3 joins -> auction -> partner -> 13 x 4 tricks -> reset over the REST
+endpoints, while each player listens on `/ws/{game_id}/{player_id}` and plays from the snapshot it
+holds. Reported: p50/p99 latency per endpoint, moves/sec, broadcast delivery lag (move request sent
+-> version received on a player's WebSocket), service memory per game and, against the fake
+AppSheet, the upstream calls made. Every table follows the same script (only the deal is shuffled
+by the service) and results carry the commit, so runs with the same arguments are comparable
+across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import IO, Any
+
+import httpx
+from websockets.asyncio.client import connect
+
+from app.model import CardEnum
+
+
+PLAYERS = 4
+PARTNER_CARDS = [card.value for card in reversed(CardEnum)]
+
+class Recorder:
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.lags: list[float] = []
+        self.moves = 0
+
+    def record(self, path: str, seconds: float, code: int) -> None:
+        self.latencies.setdefault(path, []).append(seconds)
+        if code != 0:
+            self.errors[f"{path} {code}"] = self.errors.get(f"{path} {code}", 0) + 1
+
+class Checkpoint:
+    """
+    Holds every table once its players have joined, so memory is measured at the same point each run.
+    """
+
+    def __init__(self, tables: int) -> None:
+        self.waiting = tables
+        self.arrived = asyncio.Event()
+        self.released = asyncio.Event()
+
+    async def arrive(self) -> None:
+        self.waiting -= 1
+        if self.waiting == 0:
+            self.arrived.set()
+        await self.released.wait()
+
+class Listener:
+    """
+    A player's WebSocket, keeping the latest snapshot up to date from `GAME` and `GAME_PATCH` messages.
+    """
+
+    def __init__(self, url: str, sent_at: dict[int, float], recorder: Recorder) -> None:
+        self.url = url
+        self.sent_at = sent_at
+        self.recorder = recorder
+        self.snapshot: dict[str, Any] | None = None
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+        self.websocket = None
+
+    async def start(self) -> None:
+        self.websocket = await connect(self.url, max_size = None)
+        self.task = asyncio.create_task(self.__listen())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        await self.websocket.close()
+
+    async def wait_version(self, version: int, timeout: float) -> dict[str, Any]:
+        async with self.changed:
+            await asyncio.wait_for(
+                self.changed.wait_for(lambda: self.snapshot is not None and self.snapshot["version"] >= version), timeout,
+            )
+            return self.snapshot
+
+    async def __listen(self) -> None:
+        async for text in self.websocket:
+            message = json.loads(text)
+            message_type = message["messageType"]
+            if message_type == "PING":
+                await self.websocket.send(json.dumps({"messageType": "PONG"}))
+                continue
+            if message_type == "GAME":
+                snapshot = message["snapshot"]
+            elif message_type == "GAME_PATCH":
+                if self.snapshot is None or self.snapshot["version"] != message["baseVersion"]:
+                    await self.websocket.send(json.dumps({"messageType": "RESYNC"}))
+                    continue
+                snapshot = dict(self.snapshot)
+                for op in message["patch"]:
+                    if op["op"] == "set":
+                        snapshot[op["path"]] = op["value"]
+                    else:
+                        snapshot[op["path"]] = snapshot[op["path"]][:op["at"]] + op["items"]
+                snapshot["version"] = message["version"]
+            else:
+                continue
+            sent_at = self.sent_at.get(snapshot["version"])
+            if sent_at is not None:
+                self.recorder.lags.append(time.perf_counter() - sent_at)
+            async with self.changed:
+                self.snapshot = snapshot
+                self.changed.notify_all()
+
+class GamePlayer:
+    """
+    Plays one table to the end. Every player bids 1NT if nobody has, otherwise passes, so there is
+    no trump and any card of the led suit (or any card at all) is a valid play.
+    """
+
+    def __init__(
+        self, http: httpx.AsyncClient, ws_base_url: str, game_id: str, recorder: Recorder, joined: Checkpoint, timeout: float,
+    ) -> None:
+        self.http = http
+        self.ws_base_url = ws_base_url
+        self.game_id = game_id
+        self.recorder = recorder
+        self.joined = joined
+        self.timeout = timeout
+        self.player_ids = [f"{game_id}-p{i}" for i in range(PLAYERS)]
+        self.sent_at: dict[int, float] = {}
+        self.listeners: dict[str, Listener] = {}
+        self.version = 0
+
+    async def play(self) -> None:
+        await self.__call("/game/create", {"playerId": self.player_ids[0]})
+        for player_id in self.player_ids:
+            self.listeners[player_id] = Listener(f"{self.ws_base_url}/ws/{self.game_id}/{player_id}", self.sent_at, self.recorder)
+            await self.listeners[player_id].start()
+        try:
+            for player_id in self.player_ids[1:]:
+                await self.__move("/game/join", player_id, {})
+            await self.joined.arrive()
+            while True:
+                snapshot = await self.listeners[self.player_ids[0]].wait_version(self.version, self.timeout)
+                turn: str | None = snapshot["playerTurn"]
+                if turn is None:
+                    break
+                await self.__call("/game/view", {"playerId": turn})
+                await self.__act(turn, await self.listeners[turn].wait_version(self.version, self.timeout))
+            for player_id in self.player_ids:
+                await self.__move("/game/reset", player_id, {})
+            for listener in self.listeners.values():
+                await listener.wait_version(self.version, self.timeout)
+        finally:
+            for listener in self.listeners.values():
+                await listener.close()
+
+    async def __act(self, player_id: str, snapshot: dict[str, Any]) -> None:
+        actions: list[str] = snapshot["playerActions"]
+        hand: list[str] = snapshot["playerHand"]
+        if "BID" in actions:
+            bid = "P" if any(player_bid["bid"] is not None for player_bid in snapshot["bids"]) else "1NT"
+            await self.__move("/game/bid", player_id, {"bid": bid})
+            return
+        if "CHOOSE_PARTNER" in actions:
+            partner = next(card for card in PARTNER_CARDS if card not in hand)
+            await self.__move("/game/partner", player_id, {"partner": partner})
+            return
+        tricks: list[dict[str, Any]] = snapshot["tricks"]
+        current = tricks[-1]["playerTricks"] if len(tricks) > 0 and len(tricks[-1]["playerTricks"]) < PLAYERS else []
+        lead_suit = current[0]["trick"][-1] if len(current) > 0 else None
+        candidates = [card for card in hand if card[-1] == lead_suit] + [card for card in hand if card[-1] != lead_suit]
+        for card in candidates:
+            if await self.__move("/game/trick", player_id, {"trick": card}) == 0:
+                return
+
+    async def __move(self, path: str, player_id: str, body: dict[str, Any]) -> int:
+        self.sent_at[self.version + 1] = time.perf_counter()
+        code = await self.__call(path, {"playerId": player_id, **body})
+        if code == 0:
+            self.version += 1
+            self.recorder.moves += 1
+        else:
+            self.sent_at.pop(self.version + 1, None)
+        return code
+
+    async def __call(self, path: str, body: dict[str, Any]) -> int:
+        start = time.perf_counter()
+        response = await self.http.post(path, json = {"gameId": self.game_id, **body})
+        code: int = response.json()["code"]
+        self.recorder.record(path, time.perf_counter() - start, code)
+        return code
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(app: str, port: int, env: dict[str, str], log: IO | None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env = {**os.environ, **env},
+        stdout = log if log is not None else subprocess.DEVNULL,
+        stderr = subprocess.STDOUT if log is not None else subprocess.DEVNULL,
+    )
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+def rss_kb(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr = subprocess.DEVNULL, text = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    port = free_port()
+    env = {
+        "APP_SHEET_APP_ID": "bench",
+        "APP_SHEET_GAME_TABLE": "game",
+        "APP_SHEET_APP_ACCESS_KEY": "bench",
+        "USE_APP_SHEET": "true" if args.datastore == "appsheet" else "false",
+        "WEBSOCKET_PING_INTERVAL": "3600",
+        "WEBSOCKET_SEND_QUEUE_SIZE": "1024",
+    }
+    processes: list[subprocess.Popen] = []
+    fake_appsheet_url = None
+    log = open(args.server_log, "w") if args.server_log else None
+    try:
+        if args.datastore == "appsheet":
+            fake_port = free_port()
+            fake_appsheet_url = f"http://127.0.0.1:{fake_port}"
+            processes.append(start_server("benchmark.fake_appsheet:app", fake_port, {
+                "FAKE_APPSHEET_LATENCY": str(args.latency),
+                "FAKE_APPSHEET_JITTER": str(args.jitter),
+                "FAKE_APPSHEET_ERROR_RATE": str(args.error_rate),
+                "FAKE_APPSHEET_HANG_RATE": str(args.hang_rate),
+            }, log))
+            await wait_ready(f"{fake_appsheet_url}/calls")
+            env["APP_SHEET_BASE_URL"] = fake_appsheet_url
+        service = start_server("app.main:app", port, env, log)
+        processes.append(service)
+        base_url = f"http://127.0.0.1:{port}"
+        await wait_ready(f"{base_url}/health/ready")
+        baseline_rss = rss_kb(service.pid)
+
+        recorder = Recorder()
+        joined_rss: int | None = None
+        joined = Checkpoint(args.games)
+        limits = httpx.Limits(max_connections = args.games * 2, max_keepalive_connections = args.games * 2)
+        async with httpx.AsyncClient(base_url = base_url, limits = limits, timeout = args.timeout) as http:
+            games = [
+                GamePlayer(http, f"ws://127.0.0.1:{port}", f"bench-{i}", recorder, joined, args.timeout)
+                    for i in range(args.games)
+            ]
+            start = time.perf_counter()
+            tasks = [asyncio.create_task(game.play()) for game in games]
+            try:
+                await asyncio.wait_for(joined.arrived.wait(), args.timeout)
+                joined_rss = rss_kb(service.pid)
+            except asyncio.TimeoutError:
+                pass
+            joined.released.set()
+            results = await asyncio.gather(*tasks, return_exceptions = True)
+            elapsed = time.perf_counter() - start
+        upstream_calls = None
+        if fake_appsheet_url is not None:
+            async with httpx.AsyncClient() as client:
+                upstream_calls = (await client.get(f"{fake_appsheet_url}/calls")).json()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if log is not None:
+            log.close()
+
+    failures = [repr(result) for result in results if isinstance(result, BaseException)]
+    return {
+        "commit": git_commit(),
+        "params": vars(args),
+        "elapsedSeconds": round(elapsed, 3),
+        "gamesCompleted": args.games - len(failures),
+        "moves": recorder.moves,
+        "movesPerSecond": round(recorder.moves / elapsed, 1),
+        "endpoints": {
+            path: {
+                "count": len(latencies),
+                "p50Ms": round(percentile(latencies, 50) * 1000, 2),
+                "p99Ms": round(percentile(latencies, 99) * 1000, 2),
+            } for path, latencies in sorted(recorder.latencies.items())
+        },
+        "broadcastLagMs": None if len(recorder.lags) == 0 else {
+            "count": len(recorder.lags),
+            "p50Ms": round(percentile(recorder.lags, 50) * 1000, 2),
+            "p99Ms": round(percentile(recorder.lags, 99) * 1000, 2),
+        },
+        "memoryPerGameKb": None if baseline_rss is None or joined_rss is None else round((joined_rss - baseline_rss) / args.games, 1),
+        "errors": recorder.errors,
+        "failures": failures[:10],
+        "upstreamCalls": upstream_calls,
+    }
+
+def print_report(result: dict[str, Any]) -> None:
+    print(f"commit {result['commit']}  params {result['params']}")
+    print(f"games completed {result['gamesCompleted']}  moves {result['moves']}  moves/sec {result['movesPerSecond']}")
+    print(f"{'endpoint':<20}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for path, stats in result["endpoints"].items():
+        print(f"{path:<20}{stats['count']:>8}{stats['p50Ms']:>10}{stats['p99Ms']:>10}")
+    lag = result["broadcastLagMs"]
+    if lag is not None:
+        print(f"{'broadcast lag':<20}{lag['count']:>8}{lag['p50Ms']:>10}{lag['p99Ms']:>10}")
+    print(f"memory per game {result['memoryPerGameKb']} KB")
+    if result["upstreamCalls"] is not None:
+        print(f"upstream calls {result['upstreamCalls']}")
+    if result["errors"]:
+        print(f"errors {result['errors']}")
+    for failure in result["failures"]:
+        print(f"failure {failure}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Drive concurrent 4-player games through the service.")
+    parser.add_argument("--games", type = int, default = 20, help = "concurrent games")
+    parser.add_argument("--datastore", choices = ["local", "appsheet"], default = "local")
+    parser.add_argument("--latency", type = float, default = 0.1, help = "fake AppSheet latency in seconds")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "fake AppSheet extra random latency in seconds")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of fake AppSheet calls answering 503")
+    parser.add_argument("--hang-rate", type = float, default = 0.0, help = "fraction of fake AppSheet calls hanging for a minute")
+    parser.add_argument("--timeout", type = float, default = 60.0, help = "seconds to wait for any single step")
+    parser.add_argument("--output", help = "write the result as JSON to this file")
+    parser.add_argument("--server-log", help = "write the service's (and fake AppSheet's) output to this file")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmarks of the per-move hot paths, on the same seeded games every run.
+
+    python -m benchmark.micro
+    python -m benchmark.micro --output micro.json
+
+Each case reports the best per-call time over `--repeat` rounds, for a game in the auction,
+half way through the play and finished.
+"""
+import argparse
+import json
+import random
+import subprocess
+import timeit
+from typing import Any, Callable
+
+from bridgepy.bid import Bid
+from bridgepy.game import GameId
+from bridgepy.player import PlayerBid, PlayerId, PlayerTrick
+
+from app.codec import get_game_codec
+from app.dataconverter import GameSnapshotSerializer, get_game_snapshot_patch_builder, get_game_snapshot_response_assembler
+from app.game import VersionedGame
+
+
+STAGES = {"bidding": 2, "playing": 30, "finished": 200}
+
+def play(seed: int, moves: int) -> VersionedGame:
+    """
+    A 4-player game after up to `moves` moves: 1NT then passes, partner is the first card of the
+    bid winner's opposite seat, then the first valid card of each hand.
+    """
+    random.seed(seed)
+    game = VersionedGame(id = GameId(f"micro-{seed}"), player_ids = [PlayerId(f"p{i}") for i in range(4)])
+    game.deal()
+    for _ in range(moves):
+        if not game.game_bid_ready():
+            bid = None if any(player_bid.bid is not None for player_bid in game.bids) else Bid.from_string("1NT")
+            game.bid(PlayerBid(player_id = game.next_bid_player_id(), bid = bid))
+        elif game.partner is None:
+            bid_winner = game.bid_winner().player_id
+            opposite = game.player_ids[(game.player_ids.index(bid_winner) + 2) % 4]
+            game.choose_partner(bid_winner, game.find_player_hand(opposite).cards[0])
+        elif game.game_finished():
+            break
+        else:
+            player_id = game.next_trick_player_id()
+            for card in list(game.find_player_hand(player_id).cards):
+                try:
+                    game.trick(PlayerTrick(player_id = player_id, trick = card))
+                    break
+                except Exception:
+                    continue
+        game.version += 1
+    return game
+
+def serialize_table(serializer: GameSnapshotSerializer, game: VersionedGame) -> list[str]:
+    return [serializer.serialize(game, player_id) for player_id in game.player_ids]
+
+def cases(game: VersionedGame, previous: VersionedGame) -> dict[str, Callable[[], Any]]:
+    player_id = game.player_ids[0]
+    assembler = get_game_snapshot_response_assembler()
+    # max_size 0 turns the memo off so every call does the full work
+    serializer = GameSnapshotSerializer(assembler, max_size = 0)
+    old_snapshot, new_snapshot = serializer.to_dict(previous, player_id), serializer.to_dict(game, player_id)
+    benchmarks: dict[str, Callable[[], Any]] = {
+        "player_snapshot": lambda: game.player_snapshot(player_id),
+        "assembler.convert": lambda: assembler.convert(game.player_snapshot(player_id)),
+        "serializer.serialize": lambda: serializer.serialize(game, player_id),
+        # one broadcast: every seat of the table from a cold memo
+        "serializer.table": lambda: serialize_table(GameSnapshotSerializer(assembler), game),
+        "patch_builder.convert": lambda: get_game_snapshot_patch_builder().convert((old_snapshot, new_snapshot)),
+    }
+    for name in ["jsons", "json", "compact"]:
+        codec = get_game_codec(name)
+        encoded = codec.encode(game)
+        benchmarks[f"codec.{name}.encode"] = lambda codec = codec: codec.encode(game)
+        benchmarks[f"codec.{name}.decode"] = lambda codec = codec, encoded = encoded: codec.decode(encoded)
+    return benchmarks
+
+def measure(function: Callable[[], Any], repeat: int) -> float:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat = repeat, number = number)) / number
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr = subprocess.DEVNULL, text = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Micro-benchmarks of snapshot assembly and the game codecs.")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--output", help = "write the result as JSON to this file")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, float]] = {}
+    for stage, moves in STAGES.items():
+        game = play(args.seed, moves)
+        previous = play(args.seed, moves - 1)
+        for name, function in cases(game, previous).items():
+            results.setdefault(name, {})[stage] = round(measure(function, args.repeat) * 1e6, 2)
+
+    print(f"commit {git_commit()}  seed {args.seed}  (best us per call)")
+    print(f"{'case':<24}" + "".join(f"{stage:>12}" for stage in STAGES))
+    for name, stages in results.items():
+        print(f"{name:<24}" + "".join(f"{stages[stage]:>12}" for stage in STAGES))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"commit": git_commit(), "params": vars(args), "microseconds": results}, output, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Cold start benchmark: import time, lifespan startup and first-request latency of the service.
+
+    python -m benchmark.startup
+    python -m benchmark.startup --runs 10 --datastore appsheet --latency 0.1 --output startup.json
+
+Every run is a fresh interpreter that imports `app.main`, runs the lifespan (backend start and warm
+up) and then plays create -> 3 joins -> view -> bid on one table and the same on a second table, so
+the first table pays every lazily built piece left and the second shows the warm latency. Reported:
+the median over `--runs` of each phase and of each endpoint's first and warm latency. With
+`--datastore appsheet` the fake AppSheet server is started with `--latency` seconds per call.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any
+
+
+PLAYERS = 4
+
+def play_table(client: Any, game_id: str) -> dict[str, float]:
+    latencies: dict[str, float] = {}
+
+    def call(path: str, body: dict[str, Any]) -> dict[str, Any]:
+        start = time.perf_counter()
+        response = client.post(path, json = body)
+        latencies.setdefault(path, time.perf_counter() - start)
+        result = response.json()
+        if result["code"] != 0:
+            raise RuntimeError(f"{path} failed: {result}")
+        return result
+
+    call("/game/create", {"gameId": game_id, "playerId": "p0"})
+    for i in range(1, PLAYERS):
+        call("/game/join", {"gameId": game_id, "playerId": f"p{i}"})
+    snapshot = call("/game/view", {"gameId": game_id, "playerId": "p0"})["data"]
+    call("/game/bid", {"gameId": game_id, "playerId": snapshot["playerTurn"], "bid": "1NT"})
+    return latencies
+
+def child() -> None:
+    # a fresh interpreter, so nothing of the service is imported yet
+    start = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+    from fastapi.testclient import TestClient
+    with TestClient(app) as client:
+        started = time.perf_counter()
+        ready = client.get("/health/ready").status_code == 200
+        # unique per run, the fake AppSheet keeps its tables across runs
+        first = play_table(client, f"startup-{os.getpid()}-0")
+        warm = play_table(client, f"startup-{os.getpid()}-1")
+    print(json.dumps({
+        "importSeconds": imported - start,
+        "lifespanSeconds": started - imported,
+        "ready": ready,
+        "first": first,
+        "warm": warm,
+    }))
+
+def run_child(env: dict[str, str]) -> dict[str, Any]:
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmark.startup", "--child"], env = {**os.environ, **env}, stderr = subprocess.DEVNULL, text = True,
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    # imported here, the child must start without any of the service (or httpx) imported
+    from benchmark.loadtest import free_port, git_commit, start_server, wait_ready
+    env = {
+        "APP_SHEET_APP_ID": "bench",
+        "APP_SHEET_GAME_TABLE": "game",
+        "APP_SHEET_APP_ACCESS_KEY": "bench",
+        "USE_APP_SHEET": "true" if args.datastore == "appsheet" else "false",
+    }
+    fake_appsheet = None
+    try:
+        if args.datastore == "appsheet":
+            fake_port = free_port()
+            fake_appsheet = start_server("benchmark.fake_appsheet:app", fake_port, {"FAKE_APPSHEET_LATENCY": str(args.latency)}, None)
+            await wait_ready(f"http://127.0.0.1:{fake_port}/calls")
+            env["APP_SHEET_BASE_URL"] = f"http://127.0.0.1:{fake_port}"
+        runs = [run_child(env) for _ in range(args.runs)]
+    finally:
+        if fake_appsheet is not None:
+            fake_appsheet.terminate()
+            fake_appsheet.wait()
+
+    def median_ms(values: list[float]) -> float:
+        return round(statistics.median(values) * 1000, 2)
+
+    return {
+        "commit": git_commit(),
+        "params": vars(args),
+        "importMs": median_ms([result["importSeconds"] for result in runs]),
+        "lifespanMs": median_ms([result["lifespanSeconds"] for result in runs]),
+        "ready": all(result["ready"] for result in runs),
+        "endpoints": {
+            path: {
+                "firstMs": median_ms([result["first"][path] for result in runs]),
+                "warmMs": median_ms([result["warm"][path] for result in runs]),
+            } for path in runs[0]["first"]
+        },
+    }
+
+def print_report(result: dict[str, Any]) -> None:
+    print(f"commit {result['commit']}  params {result['params']}  (median ms)")
+    print(f"import {result['importMs']}  lifespan {result['lifespanMs']}  ready {result['ready']}")
+    print(f"{'endpoint':<20}{'first':>10}{'warm':>10}")
+    for path, stats in result["endpoints"].items():
+        print(f"{path:<20}{stats['firstMs']:>10}{stats['warmMs']:>10}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Import, startup and first-request latency of the service.")
+    parser.add_argument("--runs", type = int, default = 5, help = "fresh interpreters to measure")
+    parser.add_argument("--datastore", choices = ["local", "appsheet"], default = "local")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "fake AppSheet latency in seconds")
+    parser.add_argument("--output", help = "write the result as JSON to this file")
+    parser.add_argument("--child", action = "store_true", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent = 2)
+
+if __name__ == "__main__":
+    main()
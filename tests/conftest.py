@@ -0,0 +1,61 @@
+import os
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import pytest
+
+
+# Settings requires the AppSheet credentials even when AppSheet is not used
+os.environ.setdefault("APP_SHEET_APP_ID", "test")
+os.environ.setdefault("APP_SHEET_GAME_TABLE", "game")
+os.environ.setdefault("APP_SHEET_APP_ACCESS_KEY", "test")
+os.environ.setdefault("USE_APP_SHEET", "false")
+
+from fastapi.testclient import TestClient
+import httpx
+
+from app.appsheet import AppSheetClient
+from app.backend import get_backend
+from app.main import app
+from benchmark import fake_appsheet
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+@pytest.fixture
+def client() -> Iterator[TestClient]:
+    """
+    The app on a fresh in-memory backend, with its lifespan running.
+    """
+    get_backend.cache_clear()
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def fake() -> Any:
+    """
+    The fake AppSheet with empty tables and no faults.
+    """
+    fake_appsheet.tables.clear()
+    fake_appsheet.calls.clear()
+    fake_appsheet.faults.update({"errorRate": 0.0, "hangRate": 0.0})
+    return fake_appsheet
+
+@pytest.fixture
+def fake_client(fake: Any) -> Callable[..., AppSheetClient]:
+    """
+    Builds AppSheet clients calling the fake in process, without backoff between retries.
+    """
+    def fake_client(**kwargs: Any) -> AppSheetClient:
+        return AppSheetClient(
+            "test", "test", base_url = "http://appsheet", transport = httpx.ASGITransport(app = fake.app),
+            **{"retry_backoff": 0, **kwargs},
+        )
+    return fake_client
+
+@pytest.fixture
+async def appsheet(fake_client: Callable[..., AppSheetClient]) -> AsyncIterator[AppSheetClient]:
+    appsheet = fake_client()
+    yield appsheet
+    await appsheet.close()
@@ -0,0 +1,109 @@
+from typing import Any
+
+from bridgepy.game import GameId
+from fastapi.testclient import TestClient
+
+from app.backend import get_backend
+from app.dataconverter import CARD_ENUMS
+
+
+def post(client: TestClient, path: str, body: dict[str, Any]) -> dict[str, Any]:
+    return client.post(path, json = body).json()
+
+def create_table(client: TestClient, game_id: str, player_ids: list[str]) -> None:
+    assert post(client, "/game/create", {"gameId": game_id, "playerId": player_ids[0]})["code"] == 0
+    for player_id in player_ids[1:]:
+        assert post(client, "/game/join", {"gameId": game_id, "playerId": player_id})["code"] == 0
+
+def stored_hand(client: TestClient, game_id: str, player_id: str) -> list[str]:
+    game = client.portal.call(get_backend().bridge_client.find_game, GameId(game_id))
+    return [CARD_ENUMS[card].value for card in game.find_player_hand(next(p for p in game.player_ids if p.value == player_id)).cards]
+
+def apply_patch(snapshot: dict[str, Any], patch: list[dict[str, Any]]) -> dict[str, Any]:
+    snapshot = dict(snapshot)
+    for op in patch:
+        if op["op"] == "set":
+            snapshot[op["path"]] = op["value"]
+        else:
+            snapshot[op["path"]] = snapshot[op["path"]][:op["at"]] + op["items"]
+    return snapshot
+
+def test_view_after_delete_and_recreate(client: TestClient) -> None:
+    create_table(client, "recreated", ["a", "b", "c", "d"])
+    first = post(client, "/game/view", {"gameId": "recreated", "playerId": "a"})["data"]
+    assert first["playerHand"] == stored_hand(client, "recreated", "a")
+
+    assert post(client, "/game/delete", {"gameId": "recreated"})["code"] == 0
+    create_table(client, "recreated", ["a", "b", "c", "d"])
+    second = post(client, "/game/view", {"gameId": "recreated", "playerId": "a"})["data"]
+    # same id and same version as the deleted game, but its own deal
+    assert second["version"] == first["version"]
+    assert second["playerHand"] == stored_hand(client, "recreated", "a")
+
+def test_websocket_after_delete_and_recreate(client: TestClient) -> None:
+    create_table(client, "recreated-ws", ["a", "b", "c", "d"])
+    with client.websocket_connect("/ws/recreated-ws/a") as websocket:
+        games: list[dict[str, Any]] = []
+
+        def receive_game() -> dict[str, Any]:
+            while True:
+                msg = websocket.receive_json()
+                if msg["messageType"] in ("GAME", "GAME_PATCH"):
+                    games.append(msg)
+                    return msg
+
+        snapshot = receive_game()["snapshot"]
+        assert snapshot["version"] == 3
+        assert post(client, "/game/delete", {"gameId": "recreated-ws"})["code"] == 0
+        create_table(client, "recreated-ws", ["a", "b", "c", "d"])
+        # the recreated game restarts at version 0: a full snapshot, then patches on top of it
+        msg = receive_game()
+        assert msg["messageType"] == "GAME" and msg["version"] == 0
+        snapshot = msg["snapshot"]
+        for version in range(1, 4):
+            msg = receive_game()
+            assert msg["messageType"] == "GAME_PATCH" and msg["baseVersion"] == version - 1 and msg["version"] == version
+            snapshot = apply_patch(snapshot, msg["patch"])
+        assert snapshot["playerHand"] == stored_hand(client, "recreated-ws", "a")
+
+def test_etag_after_delete_and_recreate(client: TestClient) -> None:
+    create_table(client, "recreated-etag", ["a", "b", "c", "d"])
+    body = {"gameId": "recreated-etag", "playerId": "a"}
+    etag = client.post("/game/view", json = body).headers["ETag"]
+    assert client.post("/game/view", json = body, headers = {"If-None-Match": etag}).status_code == 304
+
+    assert post(client, "/game/delete", {"gameId": "recreated-etag"})["code"] == 0
+    create_table(client, "recreated-etag", ["a", "b", "c", "d"])
+    response = client.post("/game/view", json = body, headers = {"If-None-Match": etag})
+    # same version as the deleted game, still a different game
+    assert response.status_code == 200
+    assert response.json()["data"]["version"] == 3
+    assert response.headers["ETag"] != etag
+    response = client.post("/game/view", json = {**body, "waitSeconds": 5}, headers = {"If-None-Match": etag})
+    assert response.status_code == 200
+
+def test_game_id_with_a_double_quote_is_rejected(client: TestClient) -> None:
+    for path, body in [
+        ("/game/create", {"gameId": 'a"b', "playerId": "a"}),
+        ("/game/delete", {"gameId": 'a"b'}),
+        ("/game/list", {"cursor": 'a" OR TRUE OR "'}),
+    ]:
+        result = post(client, path, body)
+        assert result["code"] == 10000
+        assert "double quote" in result["msg"]
+
+def test_actions_before_a_failing_one_are_not_applied(client: TestClient) -> None:
+    create_table(client, "batched", ["a", "b", "c", "d"])
+    before = post(client, "/game/view", {"gameId": "batched", "playerId": "a"})["data"]
+    turn = before["playerTurn"]
+    result = post(client, "/game/actions", {"gameId": "batched", "playerId": turn, "actions": [
+        {"action": "BID", "bid": "1NT"},
+        # the same player again, out of turn
+        {"action": "BID", "bid": "2NT"},
+    ]})
+    assert result["code"] not in (0, 20007)
+    first, second = result["data"]["results"]
+    assert (first["index"], first["code"]) == (0, 20007)
+    assert (second["index"], second["code"]) == (1, result["code"])
+    # rolled back: the first bid was never saved
+    assert post(client, "/game/view", {"gameId": "batched", "playerId": "a"})["data"]["version"] == before["version"]
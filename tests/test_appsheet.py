@@ -0,0 +1,95 @@
+import itertools
+import time
+from typing import Any, Callable
+
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+import pytest
+
+from app.appsheet import AppSheetClient
+from app.datastore import GameAppSheetDatastore
+from app.game import VersionedGame
+from app.resilience import CircuitBreaker
+from benchmark import fake_appsheet
+
+
+async def page_ids(datastore: GameAppSheetDatastore, limit: int) -> list[str]:
+    game_ids: list[str] = []
+    after: GameId | None = None
+    while True:
+        games = await datastore.query_page(after, limit)
+        if len(games) == 0:
+            return game_ids
+        # a page repeating the cursor would never end
+        assert after is None or games[0].id.value > after.value
+        game_ids.extend(game.id.value for game in games)
+        after = games[-1].id
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("applies_selector", [True, False])
+async def test_query_page_walks_every_game_once(
+    appsheet: AppSheetClient, monkeypatch: pytest.MonkeyPatch, applies_selector: bool,
+) -> None:
+    if not applies_selector:
+        # as the fake used to: every row whatever the selector
+        monkeypatch.setattr(fake_appsheet, "select", lambda rows, selector: rows)
+    datastore = GameAppSheetDatastore(appsheet, "game")
+    game_ids = [f"game-{i}" for i in range(7)]
+    await datastore.insert_many([VersionedGame(id = GameId(game_id), player_ids = []) for game_id in reversed(game_ids)])
+
+    assert await page_ids(datastore, 3) == game_ids
+
+@pytest.mark.anyio
+async def test_idempotent_actions_are_retried(fake: Any, fake_client: Callable[..., AppSheetClient]) -> None:
+    appsheet = fake_client(max_retries = 2)
+    fake.faults["errorRate"] = 1.0
+    with pytest.raises(BizException) as e:
+        await appsheet.rows("game", "Find", [{"id": "a"}], 20004, "find")
+    assert e.value.code == 20004
+    assert fake.calls["error"] == 3
+    # an Add may have landed before the error, it is not sent again
+    with pytest.raises(BizException):
+        await appsheet.rows("game", "Add", [{"id": "a"}], 20001, "add")
+    assert fake.calls["Add"] == 1
+    await appsheet.close()
+
+@pytest.mark.anyio
+async def test_circuit_breaker_fails_fast_until_a_probe_succeeds(fake: Any, fake_client: Callable[..., AppSheetClient]) -> None:
+    breaker = CircuitBreaker("test", failure_threshold = 3, reset_timeout = 60)
+    appsheet = fake_client(max_retries = 2, circuit_breaker = breaker)
+    fake.faults["errorRate"] = 1.0
+    with pytest.raises(BizException):
+        await appsheet.rows("game", "Find", [{"id": "a"}], 20004, "find")
+    assert fake.calls["Find"] == 3
+    with pytest.raises(BizException) as e:
+        await appsheet.rows("game", "Find", [{"id": "a"}], 20004, "find")
+    assert "circuit breaker is open" in e.value.msg
+    assert fake.calls["Find"] == 3
+
+    fake.faults["errorRate"] = 0.0
+    breaker.reset_timeout = 0
+    assert await appsheet.rows("game", "Find", [{"id": "a"}], 20004, "find") == []
+    assert breaker.opened_at is None
+    await appsheet.close()
+
+@pytest.mark.anyio
+async def test_hung_find_is_hedged(fake: Any, fake_client: Callable[..., AppSheetClient], monkeypatch: pytest.MonkeyPatch) -> None:
+    # the first call hangs, every other one answers
+    draws = itertools.chain([0.0], itertools.repeat(1.0))
+    monkeypatch.setattr(fake.random, "random", lambda: next(draws))
+    monkeypatch.setattr(fake, "HANG_SECONDS", 5.0)
+    fake.faults["hangRate"] = 0.5
+    appsheet = fake_client(hedge_delay = 0.05)
+    start = time.perf_counter()
+    assert await appsheet.rows("game", "Find", [{"id": "a"}], 20004, "find") == []
+    assert time.perf_counter() - start < 1.0
+    assert fake.calls == {"Find": 2, "hang": 1}
+    await appsheet.close()
+
+@pytest.mark.anyio
+async def test_selector_refuses_a_double_quote(fake: Any, appsheet: AppSheetClient) -> None:
+    datastore = GameAppSheetDatastore(appsheet, "game")
+    with pytest.raises(BizException) as e:
+        await datastore.query_page(GameId('a" OR TRUE OR "'), 10)
+    assert e.value.code == 20004
+    assert fake.calls == {}
@@ -0,0 +1,98 @@
+import copy
+import time
+from typing import Any, Awaitable, Callable
+
+from bridgepy.game import GameId
+from bridgepy.player import PlayerId
+from fastapi.testclient import TestClient
+import pytest
+from starlette.testclient import WebSocketTestSession
+
+from app.backend import get_backend
+from app.bridge import AsyncBridgeClient
+from app.datastore import AsyncDatastore, GameLocalDataStore
+from app.game import VersionedGame
+
+
+class CountingDatastore(AsyncDatastore[GameId, VersionedGame]):
+    """Passes every call through to `datastore`, counting them by name."""
+
+    def __init__(self, datastore: AsyncDatastore[GameId, VersionedGame]) -> None:
+        self.datastore = datastore
+        self.calls: dict[str, int] = {}
+
+    async def insert(self, entity: VersionedGame) -> None:
+        self.__count("insert")
+        await self.datastore.insert(entity)
+
+    async def update(self, entity: VersionedGame) -> None:
+        self.__count("update")
+        await self.datastore.update(entity)
+
+    async def delete(self, id: GameId) -> None:
+        self.__count("delete")
+        await self.datastore.delete(id)
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        self.__count("query")
+        return await self.datastore.query(id)
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        self.__count("query_page")
+        return await self.datastore.query_page(after, limit)
+
+    def __count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+class RacingDatastore(GameLocalDataStore):
+    """Runs `during_query` once, after a game is read and before the read returns."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.during_query: Callable[[], Awaitable[Any]] | None = None
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        game = copy.deepcopy(await super().query(id))
+        if self.during_query is not None:
+            during_query, self.during_query = self.during_query, None
+            await during_query()
+        return game
+
+def post(client: TestClient, path: str, body: dict[str, Any]) -> dict[str, Any]:
+    return client.post(path, json = body).json()
+
+def receive_version(websocket: WebSocketTestSession) -> int:
+    while True:
+        msg = websocket.receive_json()
+        if msg["messageType"] in ("GAME", "GAME_PATCH"):
+            return msg["version"]
+
+def test_one_query_and_one_update_per_move(client: TestClient) -> None:
+    bridge_client = get_backend().bridge_client
+    datastore = bridge_client.game_datastore = CountingDatastore(bridge_client.game_datastore)
+    post(client, "/game/create", {"gameId": "counted", "playerId": "a"})
+    # a seat watching, so every move is broadcast too
+    with client.websocket_connect("/ws/counted/a") as websocket:
+        assert receive_version(websocket) == 0
+        for version, player_id in enumerate(["b", "c", "d"], start = 1):
+            datastore.calls.clear()
+            assert post(client, "/game/join", {"gameId": "counted", "playerId": player_id})["code"] == 0
+            # the broadcast is out too, it must not have read the game again
+            assert receive_version(websocket) == version
+            assert datastore.calls == {"query": 1, "update": 1}
+        player_turn = post(client, "/game/view", {"gameId": "counted", "playerId": "a"})["data"]["playerTurn"]
+        datastore.calls.clear()
+        assert post(client, "/game/bid", {"gameId": "counted", "playerId": player_turn, "bid": "1NT"})["code"] == 0
+        assert receive_version(websocket) == 4
+        assert datastore.calls == {"query": 1, "update": 1}
+
+@pytest.mark.anyio
+async def test_wait_game_sees_a_change_saved_during_its_read() -> None:
+    datastore = RacingDatastore()
+    bridge_client = AsyncBridgeClient(datastore)
+    await bridge_client.create_game(PlayerId("a"), GameId("raced"))
+    datastore.during_query = lambda: bridge_client.join_game(PlayerId("b"), GameId("raced"))
+    start = time.perf_counter()
+    game = await bridge_client.wait_game(GameId("raced"), 0, 5.0)
+    assert game.version == 1
+    assert time.perf_counter() - start < 1.0
@@ -0,0 +1,183 @@
+import asyncio
+import copy
+from typing import Any
+
+from bridgepy.bid import Bid
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+from bridgepy.player import PlayerId
+import pytest
+
+from app.appsheet import AppSheetClient
+from app.bridge import AsyncBridgeClient
+from app.datastore import GameAppSheetDatastore, GameCachedDatastore, GameLocalDataStore
+from app.game import VersionedGame
+
+
+@pytest.mark.anyio
+async def test_flush_lost_to_a_newer_version_resyncs_the_game() -> None:
+    backend = GameLocalDataStore()
+    resynced: list[VersionedGame] = []
+
+    async def on_conflict(game: VersionedGame) -> None:
+        resynced.append(game)
+
+    cache = GameCachedDatastore(backend, on_conflict = on_conflict)
+    game = VersionedGame(id = GameId("raced"), player_ids = [PlayerId("a")], instance = "i")
+    await cache.insert(game)
+    await cache.flush()
+
+    # another process saves its version 1 first
+    stored = copy.deepcopy(game)
+    stored.add_player(PlayerId("b"))
+    stored.version = 1
+    await backend.update(stored)
+    lost = copy.deepcopy(game)
+    lost.add_player(PlayerId("c"))
+    lost.version = 1
+    await cache.update(lost)
+    await cache.flush()
+
+    assert resynced == [stored]
+    assert (await cache.query(game.id)).player_ids == [PlayerId("a"), PlayerId("b")]
+    assert (await backend.query(game.id)).player_ids == [PlayerId("a"), PlayerId("b")]
+
+@pytest.mark.anyio
+async def test_move_during_a_flush_is_not_a_conflict(fake: Any, appsheet: AppSheetClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    resynced: list[int] = []
+
+    async def on_conflict(game: VersionedGame) -> None:
+        resynced.append(game.version)
+
+    backend = GameAppSheetDatastore(appsheet, "game")
+    cache = GameCachedDatastore(backend, on_conflict = on_conflict)
+    bridge_client = AsyncBridgeClient(cache)
+    game_id = GameId("flushing")
+    await bridge_client.create_game(PlayerId("a"), game_id)
+    for player_id in ["b", "c", "d"]:
+        await bridge_client.join_game(PlayerId(player_id), game_id)
+    game = await bridge_client.find_game(game_id)
+    game = await bridge_client.bid(game.next_bid_player_id(), game_id, Bid.from_string("1NT"))
+
+    # the flush's version check Find is in flight when the next bid lands
+    monkeypatch.setattr(fake, "LATENCY", 0.05)
+    flush = asyncio.create_task(cache.flush())
+    await asyncio.sleep(0.02)
+    game = await bridge_client.bid(game.next_bid_player_id(), game_id, None)
+    await flush
+    await cache.flush()
+
+    assert resynced == []
+    assert (await backend.query(game_id)).version == game.version
+
+@pytest.mark.anyio
+async def test_query_many_reads_every_miss_in_one_call(fake: Any, appsheet: AppSheetClient) -> None:
+    backend = GameAppSheetDatastore(appsheet, "game")
+    cache = GameCachedDatastore(backend)
+    games = [VersionedGame(id = GameId(f"batch-{i}"), player_ids = [PlayerId("a")]) for i in range(5)]
+    await backend.insert_many(games)
+    await cache.query(games[0].id)
+    fake.calls.clear()
+
+    found = await cache.query_many([game.id for game in games] + [GameId("missing")])
+
+    assert [game.id for game in found[:5]] == [game.id for game in games] and found[5] is None
+    assert fake.calls == {"Find": 1}
+    # all of them cached now
+    await cache.query_many([game.id for game in games])
+    assert fake.calls == {"Find": 1}
+
+@pytest.mark.anyio
+async def test_delete_many_deletes_in_one_call(fake: Any, appsheet: AppSheetClient) -> None:
+    backend = GameAppSheetDatastore(appsheet, "game")
+    cache = GameCachedDatastore(backend)
+    games = [VersionedGame(id = GameId(f"reaped-{i}"), player_ids = [PlayerId("a")]) for i in range(4)]
+    await backend.insert_many(games)
+    await cache.query_many([game.id for game in games])
+    # its Add fails and stays buffered: nothing to delete upstream
+    fake.faults["errorRate"] = 1.0
+    await cache.insert(VersionedGame(id = GameId("unflushed"), player_ids = []))
+    fake.faults["errorRate"] = 0.0
+    fake.calls.clear()
+
+    await cache.delete_many([game.id for game in games] + [GameId("unflushed")])
+
+    assert fake.calls == {"Delete": 1}
+    assert await backend.query_many([game.id for game in games]) == [None] * 4
+    assert await cache.query_many([game.id for game in games] + [GameId("unflushed")]) == [None] * 5
+
+@pytest.mark.anyio
+async def test_flush_loop_outlives_a_failing_flush() -> None:
+    backend = GameLocalDataStore()
+
+    async def on_conflict(game: VersionedGame) -> None:
+        raise ConnectionError("backplane down")
+
+    cache = GameCachedDatastore(backend, flush_interval = 0.01, on_conflict = on_conflict)
+    await cache.start()
+    game = VersionedGame(id = GameId("looped"), player_ids = [PlayerId("a")], instance = "i")
+    await cache.insert(game)
+    stored = copy.deepcopy(game)
+    stored.version = 1
+    await backend.update(stored)
+    lost = copy.deepcopy(game)
+    lost.version = 1
+    await cache.update(lost)
+    await asyncio.sleep(0.05)
+
+    assert not cache.flush_task.done()
+    # still flushing
+    newer = copy.deepcopy(stored)
+    newer.version = 2
+    await cache.update(newer)
+    await asyncio.sleep(0.05)
+    assert (await backend.query(game.id)).version == 2
+    await cache.close()
+
+class FailingDatastore(GameLocalDataStore):
+
+    failing = False
+
+    async def query(self, id: GameId) -> VersionedGame | None:
+        if self.failing:
+            raise BizException(20004, "backend down")
+        return await super().query(id)
+
+@pytest.mark.anyio
+async def test_expired_game_is_served_while_the_backend_fails() -> None:
+    backend = FailingDatastore()
+    cache = GameCachedDatastore(backend, ttl = 0.05, flush_interval = 0.01)
+    await cache.start()
+    game = VersionedGame(id = GameId("expired"), player_ids = [PlayerId("a")])
+    await cache.insert(game)
+
+    backend.failing = True
+    with pytest.raises(BizException):
+        await cache.query(GameId("unknown"))
+    # several flush loop rounds past the TTL
+    await asyncio.sleep(0.15)
+    assert await cache.query(game.id) is game
+
+    backend.failing = False
+    assert await cache.query(game.id) == game
+    await asyncio.sleep(0.15)
+    assert "expired" not in cache.games
+    await cache.close()
+
+@pytest.mark.anyio
+async def test_ttl_counts_from_the_last_access() -> None:
+    backend = FailingDatastore()
+    cache = GameCachedDatastore(backend, ttl = 0.1, flush_interval = 0.01)
+    await cache.start()
+    game = VersionedGame(id = GameId("viewed"), player_ids = [PlayerId("a")])
+    await cache.insert(game)
+    # viewed for three TTLs without a move, never read from the backend
+    backend.failing = True
+    for _ in range(10):
+        await asyncio.sleep(0.03)
+        assert await cache.query(game.id) is game
+    assert not cache.backend_failing
+    backend.failing = False
+    await asyncio.sleep(0.2)
+    assert "viewed" not in cache.games
+    await cache.close()
@@ -0,0 +1,87 @@
+from dataclasses import asdict
+import random
+
+from bridgepy.bid import Bid
+from bridgepy.game import Game, GameId
+from bridgepy.player import PlayerBid, PlayerId, PlayerTrick
+import jsons
+import pytest
+
+from app.codec import GameCodec, JsonsGameCodec, OrjsonGameCodec, get_game_codec
+from app.game import VersionedGame
+
+
+CODECS = ["jsons", "json", "compact"]
+
+def play(seed: int, moves: int) -> VersionedGame:
+    random.seed(seed)
+    game = VersionedGame(id = GameId(f"codec-{seed}"), player_ids = [PlayerId(f"p{i}") for i in range(4)], instance = f"instance-{seed}")
+    game.deal()
+    for _ in range(moves):
+        if not game.game_bid_ready():
+            bid = None if any(player_bid.bid is not None for player_bid in game.bids) else Bid.from_string("2H")
+            game.bid(PlayerBid(player_id = game.next_bid_player_id(), bid = bid))
+        elif game.partner is None:
+            bid_winner = game.bid_winner().player_id
+            opposite = game.player_ids[(game.player_ids.index(bid_winner) + 2) % 4]
+            game.choose_partner(bid_winner, game.find_player_hand(opposite).cards[0])
+        elif game.game_finished():
+            for player_id in game.player_ids[:2]:
+                game.reset(player_id)
+            break
+        else:
+            player_id = game.next_trick_player_id()
+            for card in list(game.find_player_hand(player_id).cards):
+                try:
+                    game.trick(PlayerTrick(player_id = player_id, trick = card))
+                    break
+                except Exception:
+                    continue
+        game.version += 1
+    return game
+
+GAMES = [
+    VersionedGame(id = GameId("waiting"), player_ids = [PlayerId("a")]),
+    play(1, 0),
+    play(2, 3),
+    play(3, 5),
+    play(4, 30),
+    play(5, 200),
+]
+
+@pytest.mark.parametrize("name", CODECS)
+@pytest.mark.parametrize("game", GAMES, ids = lambda game: f"{game.id.value}-v{game.version}")
+def test_round_trip(name: str, game: VersionedGame) -> None:
+    codec = get_game_codec(name)
+    assert codec.decode(codec.encode(game)) == game
+
+@pytest.mark.parametrize("writer", CODECS)
+@pytest.mark.parametrize("reader", ["json", "compact"])
+@pytest.mark.parametrize("game", GAMES, ids = lambda game: f"{game.id.value}-v{game.version}")
+def test_orjson_reads_every_shape(writer: str, reader: str, game: VersionedGame) -> None:
+    assert get_game_codec(reader).decode(get_game_codec(writer).encode(game)) == game
+
+def test_json_writes_the_jsons_document() -> None:
+    game = GAMES[-1]
+    assert jsons.loads(OrjsonGameCodec(compact = False).encode(game)) == jsons.loads(JsonsGameCodec().encode(game))
+
+@pytest.mark.parametrize("codec", [JsonsGameCodec(), OrjsonGameCodec(compact = False), OrjsonGameCodec(compact = True)])
+def test_legacy_row_without_version(codec: GameCodec) -> None:
+    legacy = play(6, 12)
+    # rows written before games were versioned: a plain bridgepy Game through jsons
+    row = jsons.dumps(asdict(Game(
+        id = legacy.id,
+        player_ids = legacy.player_ids,
+        player_hands = legacy.player_hands,
+        bids = legacy.bids,
+        partner = legacy.partner,
+        partner_player_id = legacy.partner_player_id,
+        tricks = legacy.tricks,
+        reset_votes = legacy.reset_votes,
+    )))
+    assert "version" not in jsons.loads(row)
+    game = codec.decode(row)
+    assert game.version == 0 and game.instance == ""
+    legacy.version = 0
+    legacy.instance = ""
+    assert game == legacy
@@ -0,0 +1,65 @@
+import time
+from pathlib import Path
+
+from bridgepy.exception import BizException
+from bridgepy.game import GameId
+from bridgepy.player import PlayerId
+import pytest
+
+from app.datastore import GameEventSourcedDatastore, GameSQLiteDatastore
+from app.event import GameEventSQLiteStore
+from app.game import GameStatus, VersionedGame
+
+
+@pytest.mark.anyio
+async def test_moves_between_snapshots_age_the_game(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    path = str(tmp_path / "bridge.db")
+    snapshots = GameSQLiteDatastore(path)
+    datastore = GameEventSourcedDatastore(snapshots, GameEventSQLiteStore(path), snapshot_interval = 100)
+    game = VersionedGame(id = GameId("aged"), player_ids = [PlayerId("a")])
+    await datastore.insert(game)
+
+    clock[0] = 2000.0
+    game.add_player(PlayerId("b"))
+    game.version += 1
+    await datastore.update(game)
+    # a join is logged as an event, the snapshot row is still the one of the insert
+    assert (await snapshots.query(game.id)).player_ids == [PlayerId("a")]
+
+    assert await snapshots.query_ids_by_status(GameStatus.WAITING, 1500.0) == []
+    assert await snapshots.query_ids_by_status(GameStatus.WAITING, 2500.0) == [game.id]
+    await datastore.close()
+
+class FailingSnapshots(GameSQLiteDatastore):
+
+    failing = False
+
+    async def update_many(self, entities: list[VersionedGame]) -> None:
+        if self.failing:
+            raise BizException(20002, "snapshot store down")
+        await super().update_many(entities)
+
+@pytest.mark.anyio
+async def test_failed_snapshot_after_the_event_is_logged_is_not_a_failed_move(tmp_path: Path) -> None:
+    path = str(tmp_path / "bridge.db")
+    snapshots = FailingSnapshots(path)
+    datastore = GameEventSourcedDatastore(snapshots, GameEventSQLiteStore(path), snapshot_interval = 1)
+    game = VersionedGame(id = GameId("logged"), player_ids = [PlayerId("a")])
+    await datastore.insert(game)
+
+    snapshots.failing = True
+    game.add_player(PlayerId("b"))
+    game.version += 1
+    await datastore.update(game)
+    assert (await snapshots.query(game.id)).version == 0
+    assert (await datastore.query(game.id)).player_ids == [PlayerId("a"), PlayerId("b")]
+
+    # the next snapshot catches up
+    snapshots.failing = False
+    game.add_player(PlayerId("c"))
+    game.version += 1
+    await datastore.update(game)
+    assert (await snapshots.query(game.id)).version == 2
+    await datastore.close()
@@ -0,0 +1,71 @@
+import asyncio
+from typing import AsyncIterator
+
+import fakeredis
+from fastapi.testclient import TestClient
+import pytest
+import redis.asyncio
+
+from app.backend import get_backend
+from app.pubsub import RedisPubSub
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> fakeredis.FakeServer:
+    """A fake Redis server every RedisPubSub connects to."""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server = server, **kwargs))
+    return server
+
+@pytest.fixture
+async def backplanes(server: fakeredis.FakeServer) -> AsyncIterator[tuple[RedisPubSub, RedisPubSub]]:
+    """Two workers' backplanes on one fake Redis server."""
+    first, second = RedisPubSub("redis://fake"), RedisPubSub("redis://fake")
+    yield first, second
+    await first.close()
+    await second.close()
+
+@pytest.mark.anyio
+async def test_messages_reach_every_worker(backplanes: tuple[RedisPubSub, RedisPubSub]) -> None:
+    received: dict[str, asyncio.Queue[str]] = {"first": asyncio.Queue(), "second": asyncio.Queue()}
+    for name, backplane in zip(received, backplanes):
+        backplane.subscribe("game", received[name].put)
+        await backplane.start()
+
+    await backplanes[0].publish("game", "moved")
+    # the publishing worker hears its own message too, its WebSockets are fanned out the same way
+    assert await asyncio.wait_for(received["first"].get(), 5) == "moved"
+    assert await asyncio.wait_for(received["second"].get(), 5) == "moved"
+
+@pytest.mark.anyio
+async def test_failing_handler_keeps_listening(backplanes: tuple[RedisPubSub, RedisPubSub]) -> None:
+    publisher, subscriber = backplanes
+    received: asyncio.Queue[str] = asyncio.Queue()
+
+    async def handle(message: str) -> None:
+        if message == "bad":
+            raise ValueError(message)
+        await received.put(message)
+
+    subscriber.subscribe("chat", handle)
+    await subscriber.start()
+    await publisher.publish("chat", "bad")
+    await publisher.publish("chat", "good")
+    assert await asyncio.wait_for(received.get(), 5) == "good"
+
+@pytest.mark.anyio
+async def test_unsubscribed_channels_are_not_dispatched(backplanes: tuple[RedisPubSub, RedisPubSub]) -> None:
+    publisher, subscriber = backplanes
+    received: asyncio.Queue[str] = asyncio.Queue()
+    subscriber.subscribe("game", received.put)
+    await subscriber.start()
+    await publisher.publish("chat", "ignored")
+    await publisher.publish("game", "moved")
+    assert await asyncio.wait_for(received.get(), 5) == "moved"
+    assert received.empty()
+
+def test_move_is_acknowledged_while_redis_is_down(client: TestClient, server: fakeredis.FakeServer) -> None:
+    server.connected = False
+    get_backend().game_socket_manager.pubsub = RedisPubSub("redis://fake")
+    assert client.post("/game/create", json = {"gameId": "unbroadcast", "playerId": "a"}).json()["code"] == 0
+    assert client.post("/game/join", json = {"gameId": "unbroadcast", "playerId": "b"}).json()["code"] == 0
@@ -0,0 +1,43 @@
+import copy
+from typing import Any, Awaitable, Callable
+
+from bridgepy.game import GameId
+from bridgepy.player import PlayerId
+import pytest
+
+from app.bridge import AsyncBridgeClient
+from app.datastore import GameLocalDataStore
+from app.game import VersionedGame
+from app.reaper import GameReaper
+from app.websocket import GameWebSocketManager
+
+
+class ScannedDatastore(GameLocalDataStore):
+    """Runs `during_scan` once, after a page is read and before the page returns."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.during_scan: Callable[[], Awaitable[Any]] | None = None
+
+    async def query_page(self, after: GameId | None, limit: int) -> list[VersionedGame]:
+        games = copy.deepcopy(await super().query_page(after, limit))
+        if self.during_scan is not None:
+            during_scan, self.during_scan = self.during_scan, None
+            await during_scan()
+        return games
+
+@pytest.mark.anyio
+async def test_game_moved_during_the_scan_is_kept() -> None:
+    datastore = ScannedDatastore()
+    bridge_client = AsyncBridgeClient(datastore)
+    reaper = GameReaper(bridge_client, GameWebSocketManager(), idle_ttl = 0)
+    await bridge_client.create_game(PlayerId("a"), GameId("idle"))
+    await bridge_client.create_game(PlayerId("a"), GameId("played"))
+    datastore.during_scan = lambda: bridge_client.join_game(PlayerId("b"), GameId("played"))
+
+    assert await reaper.sweep() == 1
+    assert await datastore.query(GameId("idle")) is None
+    assert (await datastore.query(GameId("played"))).version == 1
+    # seen at its new version from now on
+    assert await reaper.sweep() == 1
+    assert await datastore.query(GameId("played")) is None
@@ -0,0 +1,75 @@
+import copy
+from typing import Any
+
+from bridgepy.game import GameId
+from bridgepy.player import PlayerId
+from fastapi.testclient import TestClient
+from starlette.testclient import WebSocketTestSession
+
+from app.backend import get_backend
+from app.metrics import get_metrics
+
+
+def post(client: TestClient, path: str, body: dict[str, Any]) -> dict[str, Any]:
+    return client.post(path, json = body).json()
+
+def receive_game(websocket: WebSocketTestSession) -> dict[str, Any]:
+    while True:
+        msg = websocket.receive_json()
+        if msg["messageType"] in ("GAME", "GAME_PATCH"):
+            return msg
+
+def receive_chat(websocket: WebSocketTestSession) -> str:
+    while True:
+        msg = websocket.receive_json()
+        if msg["messageType"] == "CHAT":
+            return msg["message"]
+
+def test_every_socket_of_a_seat_gets_messages(client: TestClient) -> None:
+    post(client, "/game/create", {"gameId": "tabs", "playerId": "a"})
+    post(client, "/game/join", {"gameId": "tabs", "playerId": "b"})
+    post(client, "/game/join", {"gameId": "tabs", "playerId": "c"})
+    messages = get_metrics().broadcast_game_messages.values
+    built, reused = messages.get(("built",), 0.0), messages.get(("reused",), 0.0)
+    with client.websocket_connect("/ws/tabs/a") as first, client.websocket_connect("/ws/tabs/a") as second:
+        assert receive_game(first)["version"] == 2
+        assert receive_game(second)["version"] == 2
+        assert dict(get_metrics().websocket_connections.callback())[("tabs",)] == 2
+        post(client, "/game/join", {"gameId": "tabs", "playerId": "d"})
+        first_patch, second_patch = receive_game(first), receive_game(second)
+        # both tabs hold version 2, so they share one patch built once
+        assert first_patch == second_patch
+        assert first_patch["messageType"] == "GAME_PATCH" and first_patch["version"] == 3
+        assert messages[("built",)] - built == 1
+        assert messages[("reused",)] - reused == 1
+
+        first.send_json({"messageType": "CHAT", "message": "hi"})
+        assert receive_chat(second) == "a: hi"
+
+def test_resync_sends_the_game_at_the_version_already_held(client: TestClient) -> None:
+    post(client, "/game/create", {"gameId": "resynced", "playerId": "a"})
+    post(client, "/game/join", {"gameId": "resynced", "playerId": "b"})
+    with client.websocket_connect("/ws/resynced/a") as websocket:
+        held = receive_game(websocket)
+        assert held["version"] == 1
+        game = client.portal.call(get_backend().bridge_client.find_game, GameId("resynced"))
+        # the version the socket holds, with other content: what a lost write leaves behind
+        stored = copy.deepcopy(game)
+        stored.player_ids = [PlayerId("a"), PlayerId("z")]
+        client.portal.call(get_backend().game_socket_manager.resync_game, stored)
+        resync = receive_game(websocket)
+        assert resync["messageType"] == "GAME" and resync["version"] == 1
+        assert [score["playerId"] for score in held["snapshot"]["scores"]] == ["a", "b"]
+        assert [score["playerId"] for score in resync["snapshot"]["scores"]] == ["a", "z"]
+
+def test_older_version_is_not_sent_to_a_seat(client: TestClient) -> None:
+    post(client, "/game/create", {"gameId": "late", "playerId": "a"})
+    older = copy.deepcopy(client.portal.call(get_backend().bridge_client.find_game, GameId("late")))
+    post(client, "/game/join", {"gameId": "late", "playerId": "b"})
+    with client.websocket_connect("/ws/late/a") as websocket:
+        assert receive_game(websocket)["version"] == 1
+        # version 0 delivered late, e.g. by another worker over the backplane
+        client.portal.call(get_backend().game_socket_manager.broadcast_game_snapshot, older)
+        post(client, "/game/join", {"gameId": "late", "playerId": "c"})
+        patch = receive_game(websocket)
+        assert patch["messageType"] == "GAME_PATCH" and patch["baseVersion"] == 1 and patch["version"] == 2